@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+"""Local stand-in for the Steam web endpoints arma3_utils talks to.
+
+Answers published file details API requests as well as changelog and
+filedetails pages. Items listed in outdated get a time_updated in the
+future so update checks pick them up, everything else looks unchanged
+since 2001. For tests, API requests can be answered with the status codes
+in failures first, and every answer can be held back by delay seconds.
+
+    python3 bench/fake_steam.py [port]
+"""
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+
+class fake_steam_handler(BaseHTTPRequestHandler):
+    outdated = set()
+    failures = []
+    delay = 0
+    # Forms of the API requests received, failures included
+    requests = []
+    lock = threading.Lock()
+
+    def item(self, mod_id):
+        return {'publishedfileid': mod_id,
+                'result': 1,
+                'title': 'Synthetic Mod {}'.format(mod_id),
+                'file_size': str(int(mod_id) % 1000 * 1024 * 1024),
+                'time_updated': int(time.time()) + 3600 if mod_id in self.outdated else 1000000000}
+
+    def send_body(self, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        with self.lock:
+            self.requests.append(form)
+            status = self.failures.pop(0) if self.failures else None
+        if self.delay:
+            time.sleep(self.delay)
+        if status is not None:
+            self.send_error(status)
+            return
+        mod_ids = [form['publishedfileids[{}]'.format(i)][0] for i in range(int(form['itemcount'][0]))]
+        self.send_body(json.dumps({'response': {'result': 1,
+                                                'resultcount': len(mod_ids),
+                                                'publishedfiledetails': [self.item(x) for x in mod_ids]}}),
+                       'application/json')
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/').endswith('/filedetails'):
+            mod_id = parse_qs(url.query).get('id', ['0'])[0]
+            self.send_body('<div class="workshopItemTitle">{}</div>'.format(self.item(mod_id)['title']),
+                           'text/html')
+        else:
+            mod_id = url.path.rstrip('/').split('/')[-1]
+            self.send_body('<div class="workshopAnnouncement"><p id="{}"></p></div>'.format(
+                self.item(mod_id)['time_updated']), 'text/html')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=0, outdated=(), failures=(), delay=0):
+    """ serve in a background thread, returns the server, its url is http://127.0.0.1:<server_port>
+
+    server.RequestHandlerClass.requests lists the forms of the API requests
+    it received.
+    """
+    handler = type('handler', (fake_steam_handler,), {'outdated': set(str(x) for x in outdated),
+                                                      'failures': list(failures),
+                                                      'delay': delay,
+                                                      'requests': [],
+                                                      'lock': threading.Lock()})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    server = start(int(sys.argv[1]) if len(sys.argv) > 1 else 8080)
+    print('Serving on http://127.0.0.1:{}/'.format(server.server_port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
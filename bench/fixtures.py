@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+"""Synthetic server layout for the benchmarks: workshop tree, database, configs and console log."""
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from classes.arma3_db import arma3_db
+
+APP_ID = 107410
+FIRST_MOD_ID = 1000000
+
+
+def mod_ids(count):
+    return [FIRST_MOD_ID + i for i in range(count)]
+
+
+def build_workshop(workshop_dir, count, files_per_mod, file_size):
+    """ N mods with mixed-case names, keys sometimes nested one folder deeper """
+    payload = b'x' * file_size
+    for n, mod_id in enumerate(mod_ids(count)):
+        root = os.path.join(workshop_dir, str(APP_ID), str(mod_id))
+        addons = os.path.join(root, 'Addons')
+        os.makedirs(addons)
+        for i in range(files_per_mod):
+            name = 'Mod{}_Part{}.pbo'.format(n, i) if i % 2 else 'mod{}_part{}.pbo'.format(n, i)
+            with open(os.path.join(addons, name), 'wb') as f:
+                f.write(payload)
+            with open(os.path.join(addons, name + '.Mod{}.bisign'.format(n)), 'wb') as f:
+                f.write(b'sig')
+        keys = os.path.join(root, 'Keys', 'Server') if n % 3 == 0 else os.path.join(root, 'Keys')
+        os.makedirs(keys)
+        with open(os.path.join(keys, 'Mod{}.bikey'.format(n)), 'w') as f:
+            f.write(str(mod_id))
+        with open(os.path.join(root, 'Meta.cpp'), 'w') as f:
+            f.write('publishedid = {};\n'.format(mod_id))
+
+
+def build_database(db_file, count):
+    conn = arma3_db(db_file).connect()
+    with conn:
+        conn.executemany('insert or ignore into mods (steam_id) values (?);', [(x,) for x in mod_ids(count)])
+        conn.executemany('insert or ignore into mod_folders (steam_id, folder_name) values (?, ?);',
+                         [(x, '@mod{}'.format(x)) for x in mod_ids(count)])
+    conn.close()
+
+
+def build_console_log(path, size, players=50):
+    """ write roughly size bytes of console log, everybody who joined has left by the end """
+    block = []
+    for i in range(players):
+        block.append(' 12:{:02d}:{:02d} Player Player{} connecting.\n'.format(i % 60, i % 60, i))
+        block.append(' 12:{:02d}:{:02d} "Some server chatter that fills the log up"\n'.format(i % 60, i % 60))
+    for i in range(players):
+        block.append(' 13:{:02d}:{:02d} Player Player{} disconnected.\n'.format(i % 60, i % 60, i))
+    block = ''.join(block).encode('utf-8')
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            f.write(block)
+            written += len(block)
+
+
+def build_server(base_path, count):
+    """ lgsm like folders and one mod config listing every mod """
+    for folder in ('serverfiles/mods', 'serverfiles/keys', 'lgsm/config-lgsm/arma3server',
+                   'mod_configs', 'modlists', 'log/console', 'web'):
+        os.makedirs(os.path.join(base_path, folder), exist_ok=True)
+    with open(os.path.join(base_path, 'mod_configs', 'synthetic.cfg'), 'w') as f:
+        f.write('# Synthetic Pack\n')
+        f.write('mods="{}"\n'.format(''.join('mods/@mod{}\\;'.format(x) for x in mod_ids(count))))
+
+
+def write_config(path, base_path, workshop_dir, api_url, steam_cmd):
+    with open(path, 'w') as f:
+        f.write('user:\n  username: bench\n  password: bench\n')
+        f.write('steam_cmd: {}\n'.format(steam_cmd))
+        f.write('paths:\n')
+        f.write('  base_path: {}/\n'.format(base_path))
+        f.write('  mod_directory: serverfiles/mods/\n')
+        f.write('  key_directory: serverfiles/keys/\n')
+        f.write('  config_file: lgsm/config-lgsm/arma3server/arma3server.cfg\n')
+        f.write('  mod_config_folder: mod_configs/\n')
+        f.write('  log_path: log/console/arma3server-console.log\n')
+        f.write('  workshop_dir: {}/\n'.format(workshop_dir))
+        f.write('  modlist_dir: modlists/\n')
+        f.write('  web_root: {}/web/\n'.format(base_path))
+        f.write('lgsm_binary: arma3server\n')
+        f.write('arma3_workshop_id: {}\n'.format(APP_ID))
+        f.write('steam_changelog_url: {}/sharedfiles/filedetails/changelog\n'.format(api_url))
+        f.write('steam_api_url: {}/ISteamRemoteStorage/GetPublishedFileDetails/v1/\n'.format(api_url))
+        f.write('steamcmd_retries: 2\nsteamcmd_backoff: 0\n')
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+"""Offline benchmarks for arma3_utils.
+
+Builds a synthetic server (workshop tree, database, mod config, console
+log) in a scratch folder, points config.yaml at a local fake Steam and at
+tools/fake_steamcmd.py, and runs every case in its own process. Each case
+gets a freshly built server so cases that rename or link files don't
+influence each other.
+
+Reported per case: wall time, peak RSS of the process tree and, when
+strace is installed, the number of syscalls and of forks/execs (counted in
+a second, traced run so tracing doesn't skew the wall time).
+
+    python3 bench/run_benchmarks.py --mods 200 --log-size 2G
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import fake_steam
+import fixtures
+
+MANAGER = os.path.join(REPO_DIR, 'arma3_mod_config_manager.py')
+FAKE_STEAMCMD = os.path.join(REPO_DIR, 'tools', 'fake_steamcmd.py')
+SIZE_PATTERN = re.compile(r'^(\d+)([KMG]?)$', re.I)
+FORK_SYSCALLS = ('clone', 'clone3', 'fork', 'vfork', 'execve')
+
+
+def snippet(code):
+    """ run a library call in a fresh interpreter, the way the commands do """
+    return [sys.executable, '-c', 'from classes.settings import settings; ctx = settings(); ' + code]
+
+
+# name, command, setup steps run (untimed) before the case
+CASES = [
+    ('startup', [sys.executable, MANAGER, '--help'], []),
+    ('update_mods', [sys.executable, MANAGER, 'update_mods'], []),
+    ('update_mods (nothing to do)', [sys.executable, MANAGER, 'update_mods'], ['update']),
+    ('lowercase_workshop_dir', snippet('from classes.mod_updates import lowercase_workshop_dir; '
+                                       'lowercase_workshop_dir(ctx, set())'), []),
+    ('copy_keys', snippet('from classes.mod_updates import copy_keys; copy_keys(ctx)'), ['lowercase']),
+    ('copy_keys (nothing changed)', snippet('from classes.mod_updates import copy_keys; copy_keys(ctx)'),
+     ['lowercase', 'keys']),
+    ('check_empty', snippet('from classes.server import check_empty; check_empty(ctx)'), []),
+    ('check_empty (incremental)', snippet('from classes.server import check_empty; check_empty(ctx)'),
+     ['check_empty']),
+    ('generate_modlist', [sys.executable, MANAGER, 'generate_modlist'], ['update']),
+]
+
+SETUP_STEPS = {
+    'update': [sys.executable, MANAGER, 'update_mods'],
+    'lowercase': CASES[3][1],
+    'keys': CASES[4][1],
+    'check_empty': CASES[6][1],
+}
+
+
+def parse_size(value):
+    match = SIZE_PATTERN.match(value)
+    if not match:
+        raise ValueError('Invalid size {}'.format(value))
+    return int(match.group(1)) * 1024 ** ' KMG'.index((match.group(2) or ' ').upper())
+
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument('--mods', help='Number of synthetic mods', type=int, default=100)
+    parser.add_argument('--files', help='PBOs per mod', type=int, default=20)
+    parser.add_argument('--file-size', help='Size of every PBO, e.g. 4K', default='4K')
+    parser.add_argument('--log-size', help='Size of the console log, e.g. 2G', default='64M')
+    parser.add_argument('--outdated', help='Share of mods the fake Steam reports as updated',
+                        type=float, default=0.1)
+    parser.add_argument('--case', help='Only run cases whose name contains this', action='append')
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--keep', help='Keep the scratch folder', action='store_true')
+    return parser.parse_args()
+
+
+def run_measured(command, cwd, env, strace_output=None):
+    """ run command and return (wall seconds, peak rss in KB, exit code) """
+    if strace_output:
+        command = ['strace', '-f', '-c', '-o', strace_output] + command
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 gives us the resource usage of exactly this child and what it waited for
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        if process.returncode != 0 and not strace_output:
+            stderr.seek(0)
+            print(stderr.read().decode('utf-8', 'replace'), file=sys.stderr)
+    return wall, usage.ru_maxrss, process.returncode
+
+
+def parse_strace(path):
+    """ total syscalls and forks/execs from strace -c output """
+    calls = 0
+    forks = 0
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or not fields[0][0].isdigit():
+                continue
+            if fields[-1] == 'total':
+                calls = int(fields[2])
+            elif fields[-1] in FORK_SYSCALLS:
+                forks += int(fields[3])
+    return calls, forks
+
+
+def build_server(root, args, api_url, log_path):
+    """ fresh synthetic server in root, the console log is shared through a symlink """
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    base_path = os.path.join(root, 'srv')
+    workshop_dir = os.path.join(root, 'steam', 'steamapps', 'workshop', 'content')
+    fixtures.build_server(base_path, args.mods)
+    fixtures.build_workshop(workshop_dir, args.mods, args.files, parse_size(args.file_size))
+    fixtures.build_database(os.path.join(root, 'arma3_utils.db'), args.mods)
+    fixtures.write_config(os.path.join(root, 'config.yaml'), base_path, workshop_dir, api_url, FAKE_STEAMCMD)
+    os.symlink(log_path, os.path.join(base_path, 'log', 'console', 'arma3server-console.log'))
+    os.symlink(os.path.join(base_path, 'mod_configs', 'synthetic.cfg'),
+               os.path.join(base_path, 'lgsm', 'config-lgsm', 'arma3server', 'arma3server.cfg'))
+    for mod_id in fixtures.mod_ids(args.mods):
+        os.symlink(os.path.join(workshop_dir, str(fixtures.APP_ID), str(mod_id)),
+                   os.path.join(base_path, 'serverfiles', 'mods', '@mod{}'.format(mod_id)))
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='arma3_utils_bench_')
+    outdated = fixtures.mod_ids(args.mods)[:int(args.mods * args.outdated)]
+    server = fake_steam.start(outdated=outdated)
+    api_url = 'http://127.0.0.1:{}'.format(server.server_port)
+    strace = shutil.which('strace')
+    results = []
+    try:
+        print('Building synthetic server with {} mods in {}...'.format(args.mods, workdir))
+        log_path = os.path.join(workdir, 'console.log')
+        fixtures.build_console_log(log_path, parse_size(args.log_size))
+        scratch = os.path.join(workdir, 'run')
+        env = dict(os.environ,
+                   PYTHONPATH=REPO_DIR,
+                   FAKE_STEAMCMD_ROOT=os.path.join(scratch, 'steam'))
+
+        for name, command, setup in CASES:
+            if args.case and not any(pattern in name for pattern in args.case):
+                continue
+            measurements = []
+            for traced in ([False, True] if strace else [False]):
+                build_server(scratch, args, api_url, log_path)
+                for step in setup:
+                    run_measured(SETUP_STEPS[step], scratch, env)
+                strace_output = os.path.join(workdir, 'strace.txt') if traced else None
+                measurements.append(run_measured(command, scratch, env, strace_output))
+            wall, rss, returncode = measurements[0]
+            calls, forks = parse_strace(os.path.join(workdir, 'strace.txt')) if strace else (None, None)
+            results.append({'case': name, 'wall_seconds': round(wall, 3), 'peak_rss_kb': rss,
+                            'syscalls': calls, 'forks': forks, 'exit_code': returncode})
+            print('{:<30} {:>8.3f}s {:>8.1f} MB {:>10} syscalls {:>6} forks{}'.format(
+                name, wall, rss / 1024.0,
+                calls if calls is not None else 'n/a', forks if forks is not None else 'n/a',
+                '' if returncode == 0 else '  (exit {})'.format(returncode)))
+    finally:
+        server.shutdown()
+        if args.keep:
+            print('Scratch folder kept in {}'.format(workdir))
+        else:
+            shutil.rmtree(workdir)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'mods': args.mods, 'files_per_mod': args.files, 'log_size': args.log_size,
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
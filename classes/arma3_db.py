@@ -3,20 +3,189 @@ import sqlite3
 from sqlite3 import Error
 
 class arma3_db:
-    """Simple class to manage the sqlite db"""
+    """Simple class to manage the sqlite db
+
+    The schema is built by a list of migrations that run in order, PRAGMA
+    user_version holds how many of them were applied already. Connections
+    use WAL and wait for locks, so a cron run and a manual command can
+    overlap without "database is locked".
+    """
 
     db_file = ""
 
+    # Cached workshop metadata, added to existing databases on connect
+    mod_columns = [('title', 'text'),
+                   ('time_updated', 'integer'),
+                   ('file_size', 'integer'),
+                   ('installed_at', 'integer'),
+                   ('checked_at', 'integer'),
+                   ('tree_fingerprint', 'text')]
+
+    def __init__(self, db_file="arma3_utils.db", busy_timeout=30):
+        self.db_file = db_file
+        self.busy_timeout = busy_timeout
+
+    def baseline(self, c):
+        """ everything created before migrations existed, fits databases that already have parts of it """
+        c.execute("CREATE TABLE IF NOT EXISTS mods ( " \
+                  "steam_id integer unique" \
+                  ");")
+        columns = [row[1] for row in c.execute("PRAGMA table_info(mods);").fetchall()]
+        for column, column_type in self.mod_columns:
+            if column not in columns:
+                c.execute("ALTER TABLE mods ADD COLUMN {} {};".format(column, column_type))
+        c.execute("CREATE TABLE IF NOT EXISTS log_state ( " \
+                  "log_path text primary key, " \
+                  "inode integer, " \
+                  "offset integer, " \
+                  "head blob" \
+                  ");")
+        c.execute("CREATE TABLE IF NOT EXISTS online_players ( " \
+                  "log_path text, " \
+                  "player text, " \
+                  "count integer" \
+                  ");")
+        c.execute("CREATE TABLE IF NOT EXISTS mod_files ( " \
+                  "steam_id integer, " \
+                  "path text, " \
+                  "size integer, " \
+                  "mtime_ns integer, " \
+                  "sha1 text, " \
+                  "primary key (steam_id, path)" \
+                  ");")
+
+    def add_folders_and_configs(self, c):
+        c.execute("CREATE TABLE mod_folders ( " \
+                  "steam_id integer primary key references mods (steam_id) on delete cascade, " \
+                  "folder_name text not null unique" \
+                  ");")
+        # Mods were always linked by their rowid so far, keep those names
+        c.execute("INSERT INTO mod_folders (steam_id, folder_name) " \
+                  "SELECT steam_id, CAST(rowid AS text) FROM mods WHERE steam_id IS NOT NULL;")
+        c.execute("CREATE TABLE install_paths ( " \
+                  "steam_id integer primary key references mods (steam_id) on delete cascade, " \
+                  "path text not null" \
+                  ");")
+        c.execute("CREATE TABLE configs ( " \
+                  "config_id integer primary key, " \
+                  "name text not null unique, " \
+                  "title text" \
+                  ");")
+        c.execute("CREATE TABLE config_mods ( " \
+                  "config_id integer not null references configs (config_id) on delete cascade, " \
+                  "steam_id integer not null references mods (steam_id) on delete cascade, " \
+                  "position integer not null, " \
+                  "primary key (config_id, steam_id)" \
+                  ");")
+        c.execute("CREATE INDEX config_mods_steam_id ON config_mods (steam_id);")
+        c.execute("CREATE INDEX online_players_log_path ON online_players (log_path);")
+        c.execute("CREATE INDEX mods_checked_at ON mods (checked_at);")
+
+    def add_key_index(self, c):
+        c.execute("CREATE TABLE mod_keys ( " \
+                  "steam_id integer not null references mods (steam_id) on delete cascade, " \
+                  "key_name text not null, " \
+                  "key_path text not null, " \
+                  "primary key (steam_id, key_name)" \
+                  ");")
+        # tree_fingerprint of the mod when its keys were last indexed
+        c.execute("ALTER TABLE mods ADD COLUMN keys_fingerprint text;")
+
+    def add_releases(self, c):
+        # Staged mod versions, activated_at stays empty until the links were swapped to it
+        c.execute("CREATE TABLE releases ( " \
+                  "steam_id integer not null references mods (steam_id) on delete cascade, " \
+                  "path text not null unique, " \
+                  "previous_path text, " \
+                  "staged_at integer not null, " \
+                  "activated_at integer" \
+                  ");")
+        c.execute("CREATE INDEX releases_steam_id ON releases (steam_id);")
+
+    def add_log_analytics(self, c):
+        # Console logs that were indexed, recognised by the hash of their first bytes
+        c.execute("CREATE TABLE log_files ( " \
+                  "file_id integer primary key, " \
+                  "instance text, " \
+                  "path text not null, " \
+                  "head_sha1 text not null unique, " \
+                  "size integer not null, " \
+                  "indexed_at integer not null" \
+                  ");")
+        c.execute("CREATE TABLE player_sessions ( " \
+                  "file_id integer not null references log_files (file_id) on delete cascade, " \
+                  "player text not null, " \
+                  "connected_at integer not null, " \
+                  "disconnected_at integer not null, " \
+                  "duration integer not null, " \
+                  "open integer not null" \
+                  ");")
+        c.execute("CREATE INDEX player_sessions_file_id ON player_sessions (file_id);")
+        c.execute("CREATE INDEX player_sessions_player ON player_sessions (player, connected_at);")
+        c.execute("CREATE TABLE hourly_occupancy ( " \
+                  "file_id integer not null references log_files (file_id) on delete cascade, " \
+                  "hour integer not null, " \
+                  "player_seconds integer not null, " \
+                  "peak integer not null, " \
+                  "primary key (file_id, hour)" \
+                  ");")
+
+    def add_release_instances(self, c):
+        # Instances already switched to a staged release, it's activated once every instance is
+        c.execute("CREATE TABLE release_instances ( " \
+                  "path text not null references releases (path) on delete cascade, " \
+                  "instance text not null, " \
+                  "switched_at integer not null, " \
+                  "primary key (path, instance)" \
+                  ");")
+
+    def drop_configs(self, c):
+        # Config membership is read from the config files, a copy here would only drift from them
+        c.execute("DROP TABLE config_mods;")
+        c.execute("DROP TABLE configs;")
+
+    def migrations(self):
+        # Only ever append here, applied migrations are counted by position
+        return [self.baseline,
+                self.add_folders_and_configs,
+                self.add_key_index,
+                self.add_releases,
+                self.add_log_analytics,
+                self.add_release_instances,
+                self.drop_configs]
+
+    def migrate(self, conn):
+        version = conn.execute("PRAGMA user_version;").fetchone()[0]
+        for number, migration in enumerate(self.migrations()[version:], version + 1):
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE;")
+            try:
+                # Another process might have migrated while we waited for the lock
+                if c.execute("PRAGMA user_version;").fetchone()[0] >= number:
+                    conn.rollback()
+                    continue
+                migration(c)
+                c.execute("PRAGMA user_version = {};".format(number))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def connect(self):
+        """ open the database and bring its schema up to date """
+        conn = sqlite3.connect(self.db_file, timeout=self.busy_timeout)
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute("PRAGMA busy_timeout = {};".format(int(self.busy_timeout * 1000)))
+        conn.execute("PRAGMA foreign_keys = ON;")
+        self.migrate(conn)
+        return conn
+
     def create_connection(self):
         """ create a database connection to a SQLite database """
         conn = None
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self.connect()
             print(sqlite3.version)
-            c = conn.cursor()
-            c.execute("CREATE TABLE IF NOT EXISTS mods ( " \
-                      "steam_id integer unique" \
-                      ");")
         except Error as e:
             print(e)
         finally:
@@ -25,4 +194,4 @@ class arma3_db:
 
 
     if __name__ == '__main__':
-        create_connection(r"arma3_utils.db")
\ No newline at end of file
+        create_connection(r"arma3_utils.db")
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from classes.manifest import hash_file, scan_tree
+from classes.metrics import timed
+from classes.releases import releases_directory
+
+# Linking files smaller than a filesystem block saves next to nothing
+MIN_SIZE = 4096
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024.0
+
+
+def dedup_trees(ctx):
+    """ {steam_id: root} of the mods whose files may be hardlinked
+
+    Only releases qualify, steamcmd never writes to them again. Files in its
+    own workshop folder could be patched in place by a later validate,
+    which would change every linked copy at once.
+    """
+    root = releases_directory(ctx) + os.sep
+    trees = {}
+    for mod_name, mod_id in ctx.mods:
+        # The newest version of a mod, the one its manifest describes
+        path = ctx.mod_path(mod_id, staged=True)
+        if path.startswith(root) and os.path.isdir(path):
+            trees[mod_id] = path
+    return trees
+
+
+def find_duplicates(ctx, trees, min_size):
+    """ [[(steam_id, relative path, path, size)] of identical files]
+
+    Files are grouped by size first, only sizes shared by several files
+    are hashed. Hashes stored with the manifest are reused as long as
+    size and mtime still match, new ones are stored for the next run.
+    """
+    by_size = defaultdict(list)
+    for steam_id, root in trees.items():
+        for relpath, (size, mtime_ns) in scan_tree(root).items():
+            if size >= min_size:
+                by_size[size].append((steam_id, relpath, os.path.join(root, relpath), size, mtime_ns))
+    candidates = [entry for entries in by_size.values() if len(entries) > 1 for entry in entries]
+
+    known = {}
+    for steam_id in set(entry[0] for entry in candidates):
+        for relpath, stored in ctx.manifest.load(steam_id).items():
+            known[(steam_id, relpath)] = stored
+    hashes = {}
+    jobs = []
+    for steam_id, relpath, path, size, mtime_ns in candidates:
+        stored = known.get((steam_id, relpath))
+        if stored is not None and stored[:2] == (size, mtime_ns) and stored[2]:
+            hashes[(steam_id, relpath)] = stored[2]
+        else:
+            jobs.append((steam_id, relpath, path, size, mtime_ns))
+
+    if jobs:
+        print("Hashing {} file(s) that share their size with another one...".format(len(jobs)))
+        with ProcessPoolExecutor(max_workers=ctx.config.get('hash_workers')) as executor:
+            for job, sha1 in zip(jobs, executor.map(hash_file, [job[2] for job in jobs], chunksize=16)):
+                hashes[(job[0], job[1])] = sha1
+        with ctx.conn:
+            ctx.conn.executemany("INSERT OR REPLACE INTO mod_files (steam_id, path, size, mtime_ns, sha1) "
+                                 "VALUES (?, ?, ?, ?, ?);",
+                                 [(steam_id, relpath, size, mtime_ns, hashes[(steam_id, relpath)])
+                                  for steam_id, relpath, path, size, mtime_ns in jobs])
+        ctx.metrics.count('files_hashed', len(jobs))
+
+    groups = defaultdict(list)
+    for steam_id, relpath, path, size, mtime_ns in candidates:
+        groups[(size, hashes[(steam_id, relpath)])].append((steam_id, relpath, path, size))
+    return [entries for entries in groups.values() if len(entries) > 1]
+
+
+def link_group(entries, dry_run):
+    """ hardlink every file of a group to one of them, returns ([(entry, new stat)], bytes freed) """
+    stats = [(entry, os.stat(entry[2])) for entry in entries]
+    # Keep the inode with the most links, it's most likely shared already
+    keeper_entry, keeper = max(stats, key=lambda item: item[1].st_nlink)
+    # An inode is only freed once all of its links point elsewhere
+    references = Counter((stat.st_dev, stat.st_ino) for entry, stat in stats)
+    linked = []
+    freed = 0
+    counted = set()
+    for entry, stat in stats:
+        inode = (stat.st_dev, stat.st_ino)
+        if inode == (keeper.st_dev, keeper.st_ino) or stat.st_dev != keeper.st_dev:
+            continue
+        if inode not in counted and stat.st_nlink <= references[inode]:
+            freed += stat.st_size
+            counted.add(inode)
+        if dry_run:
+            linked.append((entry, stat))
+            continue
+        # Link under a temporary name and rename over the copy, the file is never missing
+        temp_path = os.path.join(os.path.dirname(entry[2]), '.{}.dedup'.format(os.path.basename(entry[2])))
+        if os.path.lexists(temp_path):
+            os.unlink(temp_path)
+        os.link(keeper_entry[2], temp_path)
+        os.replace(temp_path, entry[2])
+        linked.append((entry, keeper))
+    return linked, freed
+
+
+@timed('dedup')
+def dedup(ctx, dry_run=False, min_size=MIN_SIZE):
+    """ hardlink identical files across mod releases, returns the number of bytes freed """
+    trees = dedup_trees(ctx)
+    if not trees:
+        print('No mod releases to deduplicate, mods are only eligible once they were updated.')
+        return 0
+    groups = find_duplicates(ctx, trees, min_size)
+
+    linked = 0
+    freed = 0
+    wasted = []
+    for entries in groups:
+        group_linked, group_freed = link_group(entries, dry_run)
+        linked += len(group_linked)
+        freed += group_freed
+        if group_freed:
+            wasted.append((group_freed, entries))
+        if not dry_run and group_linked:
+            # The copies now carry the mtime of the file they're linked to
+            with ctx.conn:
+                ctx.conn.executemany("UPDATE mod_files SET mtime_ns = ? WHERE steam_id = ? AND path = ?;",
+                                     [(stat.st_mtime_ns, entry[0], entry[1]) for entry, stat in group_linked])
+
+    if dry_run:
+        for group_freed, entries in sorted(wasted, key=lambda item: item[0], reverse=True)[:10]:
+            print("{} in {} copies of {}".format(format_size(group_freed), len(entries),
+                                                  ', '.join(sorted(set(entry[1] for entry in entries)))))
+        print("{} duplicate file(s) in {} group(s), {} would be freed".format(linked, len(groups),
+                                                                            format_size(freed)))
+    else:
+        print("Linked {} duplicate file(s) in {} group(s), freed {}".format(linked, len(groups),
+                                                                           format_size(freed)))
+        ctx.metrics.count('files_deduplicated', linked)
+        ctx.metrics.count('bytes_reclaimed', freed)
+    return freed
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from classes.dedup import format_size
+from classes.releases import steamcmd_directory
+
+
+def parse_deadline(text, now=None):
+    """ unix time of the next HH:MM, tomorrow if that time of day already passed """
+    now = now or datetime.now()
+    hours, minutes = (int(x) for x in text.split(':'))
+    deadline = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+    if deadline <= now:
+        deadline += timedelta(days=1)
+    return time.mktime(deadline.timetuple())
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}h{:02d}m'.format(hours, minutes) if hours else '{}m{:02d}s'.format(minutes, seconds)
+
+
+class download_scheduler:
+    """Spreads downloads over several steamcmd sessions, ordered by their size on the workshop
+
+    Every session downloads into its own folder below the staging area.
+    Items that fail go to the back of the queue so they don't hold up the
+    rest. With a deadline nothing is started that can't finish in time and
+    sessions still running at the deadline are stopped, whatever steamcmd
+    reported as downloaded by then is complete.
+    """
+
+    def __init__(self, ctx, deadline=None):
+        config = ctx.config.get('downloads') or {}
+        self.ctx = ctx
+        self.workers = max(config.get('workers') or 1, 1)
+        if self.workers > 1 and not config.get('parallel_logins'):
+            # Steam may end a session when the same account logs in again elsewhere
+            print("!! downloads.workers is {}, but parallel_logins isn't set, using one steamcmd session !!".format(
+                self.workers))
+            self.workers = 1
+        self.batch_size = config.get('batch_size')
+        self.max_kbps = config.get('max_kbps')
+        self.order = config.get('order') or 'smallest'
+        self.deadline = deadline
+        # Every session gets its share of the cap, rounding down to 0 would leave it out altogether
+        self.throttle = max(self.max_kbps // self.workers, 1) if self.max_kbps else None
+        self.lock = threading.Lock()
+        # {steam_id: size} of the items steamcmd reported as downloaded so far
+        self.finished = {}
+
+    def sizes(self, mod_ids):
+        # Stored with the update check, so this rarely needs to ask steam
+        metadata = self.ctx.metadata.get(mod_ids, 'file_size')
+        return dict((mod_id, (metadata.get(mod_id) or {}).get('file_size')) for mod_id in mod_ids)
+
+    def ordered(self, sizes):
+        known = sorted((mod_id for mod_id in sizes if sizes[mod_id]), key=lambda mod_id: (sizes[mod_id], mod_id),
+                       reverse=self.order == 'largest')
+        # Without a size there's nothing to estimate, those go last
+        return known + sorted(mod_id for mod_id in sizes if not sizes[mod_id])
+
+    def rate(self, done_bytes, started):
+        """ bytes per second over all sessions, the bandwidth cap until something finished """
+        elapsed = time.time() - started
+        if done_bytes and elapsed > 0:
+            return done_bytes / elapsed
+        if self.max_kbps:
+            return self.max_kbps * 1000 / 8.0
+        return None
+
+    def next_batch(self, queue, sizes, rate, postponed):
+        """ take the next items that are due off the queue, postponing those that can't make the deadline """
+        now = time.time()
+        limit = self.batch_size or -(-len(queue) // self.workers)
+        batch = []
+        finish = now
+        for entry in list(queue):
+            mod_id, tries, not_before = entry
+            if not_before > now:
+                continue
+            if self.deadline is not None and rate and sizes[mod_id]:
+                # A session only gets its share of the bandwidth
+                seconds = sizes[mod_id] / (rate / self.workers)
+                if now + seconds > self.deadline:
+                    print("Postponing {}, {} won't finish before the deadline".format(
+                        mod_id, format_size(sizes[mod_id])))
+                    queue.remove(entry)
+                    postponed.add(mod_id)
+                    continue
+                if batch and finish + seconds > self.deadline:
+                    break
+                finish += seconds
+            queue.remove(entry)
+            batch.append(entry)
+            if len(batch) >= limit:
+                break
+        return batch
+
+    def done_bytes(self):
+        with self.lock:
+            return sum(self.finished.values())
+
+    def item_downloaded(self, mod_id):
+        """ progress of one item, called from the thread reading its session's output """
+        with self.lock:
+            self.finished[mod_id] = self.item_sizes.get(mod_id) or 0
+            self.print_progress(len(self.finished), len(self.item_sizes), sum(self.finished.values()),
+                                self.total, self.started)
+
+    def run(self, mod_ids):
+        """ download mod_ids, returns ({steam_id: steamcmd folder}, failed ids, postponed ids)
+
+        A progress line with an ETA is printed for every item as soon as
+        steamcmd reports it, not only when its session ends.
+        """
+        ctx = self.ctx
+        sizes = self.item_sizes = self.sizes(mod_ids)
+        queue = [(mod_id, 0, 0) for mod_id in self.ordered(sizes)]
+        total = self.total = sum(size or 0 for size in sizes.values())
+        print("Downloading {} mod(s), {} in {} steamcmd session(s) at a time".format(
+            len(queue), format_size(total), self.workers))
+
+        downloaded = {}
+        failed = set()
+        postponed = set()
+        self.finished = {}
+        started = self.started = time.time()
+        free = list(range(self.workers))
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while queue or running:
+                if self.deadline is not None and time.time() >= self.deadline and queue:
+                    postponed.update(mod_id for mod_id, tries, not_before in queue)
+                    queue = []
+                while free and queue:
+                    batch = self.next_batch(queue, sizes, self.rate(self.done_bytes(), started), postponed)
+                    if not batch:
+                        break
+                    worker = free.pop(0)
+                    timeout = self.deadline - time.time() if self.deadline is not None else None
+                    future = executor.submit(ctx.steamcmd.download, [mod_id for mod_id, tries, not_before in batch],
+                                             steamcmd_directory(ctx, worker), self.throttle, timeout,
+                                             self.item_downloaded)
+                    running[future] = (worker, batch)
+                if not running:
+                    if queue:
+                        # Everything left waits for its retry
+                        time.sleep(max(min(not_before for mod_id, tries, not_before in queue) - time.time(), 0))
+                    continue
+
+                due = [not_before for mod_id, tries, not_before in queue] if free else []
+                finished, pending = wait(running, return_when=FIRST_COMPLETED,
+                                         timeout=max(min(due) - time.time(), 0) if due else None)
+                for future in finished:
+                    worker, batch = running.pop(future)
+                    free.append(worker)
+                    succeeded, unfinished = future.result()
+                    for mod_id, tries, not_before in batch:
+                        if mod_id in succeeded:
+                            downloaded[mod_id] = steamcmd_directory(ctx, worker)
+                            continue
+                        # Reported early but failed after all, it doesn't count towards the progress
+                        with self.lock:
+                            self.finished.pop(mod_id, None)
+                        if self.deadline is not None and time.time() >= self.deadline:
+                            postponed.add(mod_id)
+                        elif tries + 1 >= ctx.steamcmd_retries:
+                            failed.add(mod_id)
+                        else:
+                            delay = ctx.steamcmd_backoff * 2 ** tries
+                            print("Retrying {} in {}s...".format(mod_id, delay))
+                            ctx.metrics.count('steamcmd_retries')
+                            queue.append((mod_id, tries + 1, time.time() + delay))
+        return downloaded, failed, postponed
+
+    def print_progress(self, done, count, done_bytes, total, started):
+        rate = self.rate(done_bytes, started)
+        eta = ', ETA {}'.format(format_duration((total - done_bytes) / rate)) if rate and done < count else ''
+        print("{}/{} mod(s) downloaded, {} of {}{}".format(done, count, format_size(done_bytes),
+                                                           format_size(total), eta))
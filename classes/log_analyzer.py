@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+import glob
+import gzip
+import hashlib
+import mmap
+import os
+import re
+import struct
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from classes.metrics import timed
+from classes.server import LOGIN_PATTERN, LOGOUT_PATTERN
+
+# Files are recognised by their first bytes, so a log that was rotated or gzipped isn't read again
+HEAD_SIZE = 4096
+CHUNK_SIZE = 32 * 1024 * 1024
+# Console lines only carry the time of day, going back by more than this means the date changed
+MIDNIGHT_SLACK = 3600
+
+
+@lru_cache(maxsize=None)
+def compile_line_pattern(pattern):
+    # The server's line patterns, applied to a whole buffer instead of line by line
+    if pattern.endswith('$'):
+        # With re.M $ only matches before \n, logs written on Windows end their lines with \r\n
+        pattern = pattern[:-1] + r'\r?$'
+    return re.compile(pattern.encode('utf-8'), re.M)
+
+
+def find_events(buffer, patterns, start=0, end=None, base=0):
+    """ (offset, seconds of the day, +1 for a login / -1 for a logout, player) in buffer[start:end] """
+    events = []
+    end = len(buffer) if end is None else end
+    for change, pattern in ((1, patterns[0]), (-1, patterns[1])):
+        for match in compile_line_pattern(pattern).finditer(buffer, start, end):
+            line = match.group(0)
+            # ^\s may match the newline of an empty line, the patterns are meant for single lines
+            if b'\n' in line:
+                continue
+            fields = line.split(None, 3)
+            hours, minutes, seconds = (int(x) for x in fields[0].split(b':'))
+            events.append((base + match.start(), hours * 3600 + minutes * 60 + seconds, change,
+                           fields[2].decode('utf-8', 'replace')))
+    return events
+
+
+def scan_chunk(path, start, end, patterns):
+    """ events between two line boundaries of a plain log """
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return find_events(buffer, patterns, start, end)
+
+
+def scan_gzip(path, patterns):
+    """ events of a gzipped log, decompressed in chunks that end on a line boundary """
+    events = []
+    offset = 0
+    rest = b''
+    with gzip.open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            buffer = rest + chunk
+            cut = buffer.rfind(b'\n') + 1
+            events.extend(find_events(buffer, patterns, 0, cut, offset))
+            offset += cut
+            rest = buffer[cut:]
+    if rest:
+        events.extend(find_events(rest, patterns, 0, None, offset))
+    return events
+
+
+def read_head(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return f.read(HEAD_SIZE)
+
+
+def content_size(path):
+    """ uncompressed size, gzip only keeps it modulo 2^32 """
+    if not path.endswith('.gz'):
+        return os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', f.read(4))[0]
+
+
+def chunk_bounds(path):
+    """ (start, end) pairs of about CHUNK_SIZE that start and end on a line boundary """
+    bounds = []
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            start = 0
+            while start < len(buffer):
+                end = buffer.find(b'\n', min(start + CHUNK_SIZE, len(buffer)) - 1) + 1 or len(buffer)
+                bounds.append((start, end))
+                start = end
+    return bounds
+
+
+def timestamps(events, mtime):
+    """ turn seconds of the day into unix times, the last event happened on the day of mtime """
+    days = 0
+    previous = None
+    for offset, seconds, change, player in events:
+        if previous is not None and seconds < previous - MIDNIGHT_SLACK:
+            days += 1
+        previous = seconds
+    end = datetime.fromtimestamp(mtime)
+    end_day = datetime(end.year, end.month, end.day)
+    # Written just after midnight, the last line is still from the day before
+    if previous is not None and previous > end.hour * 3600 + end.minute * 60 + end.second + 60:
+        end_day -= timedelta(days=1)
+    day = time.mktime((end_day - timedelta(days=days)).timetuple())
+
+    result = []
+    previous = None
+    for offset, seconds, change, player in events:
+        if previous is not None and seconds < previous - MIDNIGHT_SLACK:
+            day += 86400
+        previous = seconds
+        result.append((int(day) + seconds, change, player))
+    return result
+
+
+def sessions_and_occupancy(events):
+    """ player sessions and {hour: [player seconds, peak]} of one log, events in log order
+
+    Players are counted the way the server check does: a logout only ends
+    a session once every login of that name logged out. Sessions still
+    open when the log ends are closed at its last event.
+    """
+    online = Counter()
+    started = {}
+    sessions = []
+    hours = defaultdict(lambda: [0, 0])
+    if not events:
+        return sessions, {}
+    previous = events[0][0]
+    for timestamp, change, player in events:
+        timestamp = max(timestamp, previous)
+        # Spread the time since the last event over the hours it covers
+        count = sum(online.values())
+        t = previous
+        while t < timestamp:
+            hour = t - t % 3600
+            step = min(hour + 3600, timestamp) - t
+            hours[hour][0] += count * step
+            hours[hour][1] = max(hours[hour][1], count)
+            t += step
+        previous = timestamp
+        if change > 0:
+            if online[player] == 0:
+                started[player] = timestamp
+            online[player] += 1
+        elif online[player] > 0:
+            online[player] -= 1
+            if online[player] == 0:
+                del online[player]
+                sessions.append((player, started.pop(player), timestamp, 0))
+        hour = timestamp - timestamp % 3600
+        hours[hour][1] = max(hours[hour][1], sum(online.values()))
+    for player in online:
+        sessions.append((player, started[player], previous, 1))
+    return sessions, dict(hours)
+
+
+def log_files(instance):
+    """ the console log and its rotated copies, oldest first
+
+    Copies are either named after the whole log, like logrotate's
+    console.log.1.gz, or after its name without .log, like the
+    <selfname>-console-YYYY-MM-DD-HH:MM:SS.log archives of lgsm.
+    """
+    log_path = glob.escape(instance.log_path)
+    stem = glob.escape(instance.log_path[:-len('.log')] if instance.log_path.endswith('.log') else instance.log_path)
+    paths = set()
+    for pattern in (log_path + '*', stem + '-*.log', stem + '-*.log.gz'):
+        paths.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+    return sorted(paths, key=os.path.getmtime)
+
+
+@timed('analyze_logs')
+def analyze_logs(ctx, instances):
+    """ index player sessions of every console log of instances that wasn't indexed yet """
+    pending = {}
+    for instance in instances:
+        for path in log_files(instance):
+            head = read_head(path)
+            if len(head) < HEAD_SIZE:
+                # Too short to be recognised once it grows or gets rotated
+                continue
+            head_sha1 = hashlib.sha1(head).hexdigest()
+            size = content_size(path)
+            row = ctx.conn.execute('select file_id, size from log_files where head_sha1 = ?;',
+                                   (head_sha1,)).fetchone()
+            if row is not None and row[1] % 2 ** 32 == size % 2 ** 32:
+                continue
+            # The same log can be there twice, e.g. while logrotate compresses it, read the longer one
+            if head_sha1 not in pending or pending[head_sha1][3] < size:
+                pending[head_sha1] = (instance.name, path, head_sha1, size, row[0] if row else None)
+    pending = sorted(pending.values(), key=lambda entry: os.path.getmtime(entry[1]))
+
+    if not pending:
+        print('All console logs are indexed already.')
+        return 0
+
+    print('Indexing {} console log(s)...'.format(len(pending)))
+    patterns = (LOGIN_PATTERN.pattern, LOGOUT_PATTERN.pattern)
+    with ProcessPoolExecutor(max_workers=ctx.config.get('log_workers')) as executor:
+        futures = []
+        for name, path, head_sha1, size, file_id in pending:
+            if path.endswith('.gz'):
+                futures.append([executor.submit(scan_gzip, path, patterns)])
+            else:
+                futures.append([executor.submit(scan_chunk, path, start, end, patterns)
+                                for start, end in chunk_bounds(path)])
+
+        for (name, path, head_sha1, size, file_id), file_futures in zip(pending, futures):
+            events = sorted(event for future in file_futures for event in future.result())
+            sessions, hours = sessions_and_occupancy(timestamps(events, os.path.getmtime(path)))
+            with ctx.conn:
+                if file_id is not None:
+                    # The log grew since it was indexed, start over with it
+                    ctx.conn.execute('delete from log_files where file_id = ?;', (file_id,))
+                file_id = ctx.conn.execute('insert into log_files (instance, path, head_sha1, size, indexed_at) '
+                                           'values (?, ?, ?, ?, ?);',
+                                           (name, path, head_sha1, size, int(time.time()))).lastrowid
+                ctx.conn.executemany('insert into player_sessions (file_id, player, connected_at, '
+                                     'disconnected_at, duration, open) values (?, ?, ?, ?, ?, ?);',
+                                     [(file_id, player, start, end, end - start, still_open)
+                                      for player, start, end, still_open in sessions])
+                ctx.conn.executemany('insert into hourly_occupancy (file_id, hour, player_seconds, peak) '
+                                     'values (?, ?, ?, ?);',
+                                     [(file_id, hour, seconds, peak) for hour, (seconds, peak) in hours.items()])
+            print("{}: {} session(s) over {} hour(s)".format(path, len(sessions), len(hours)))
+            ctx.metrics.count('log_files_indexed')
+            ctx.metrics.count('log_bytes_scanned', size)
+            ctx.metrics.count('sessions_recorded', len(sessions))
+    return len(pending)
+
+
+def print_occupancy(ctx, instances):
+    """ average and peak players per hour of the day, the quietest hours first """
+    for instance in instances:
+        rows = ctx.conn.execute("select cast(strftime('%H', o.hour, 'unixepoch', 'localtime') as integer), "
+                                "sum(o.player_seconds) / 3600.0 / count(distinct o.hour), max(o.peak) "
+                                "from hourly_occupancy o join log_files f on f.file_id = o.file_id "
+                                "where f.instance = ? group by 1 order by 1;", (instance.name,)).fetchall()
+        if not rows:
+            continue
+        print('Players per hour of the day on {}:'.format(instance.name))
+        for hour, average, peak in rows:
+            print('  {:02d}:00  {:6.2f} average  {:4d} peak'.format(hour, average, peak))
+        quietest = sorted(rows, key=lambda row: (row[1], row[2]))[:3]
+        print('Quietest hours: {}'.format(', '.join('{:02d}:00'.format(hour) for hour, average, peak in quietest)))
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+import hashlib
+import os
+
+
+def merge_tree(source, target):
+    """ move everything in source into target, replacing what's there, and remove source """
+    collisions = []
+    with os.scandir(source) as it:
+        for entry in it:
+            target_path = os.path.join(target, entry.name)
+            if entry.is_dir(follow_symlinks=False) and os.path.isdir(target_path) \
+                    and not os.path.islink(target_path):
+                collisions += merge_tree(entry.path, target_path)
+            elif os.path.isdir(target_path) and not os.path.islink(target_path):
+                collisions.append(entry.path)
+            else:
+                os.replace(entry.path, target_path)
+    if not collisions:
+        os.rmdir(source)
+    return collisions
+
+
+def lowercase_tree(path, replace=False):
+    """ rename everything below path to lowercase, deepest entries first
+
+    Returns the number of renamed entries and a list of paths that were left
+    alone because their lowercase name is already taken. With replace the
+    renamed entry wins instead, which is what we want after steamcmd wrote
+    fresh mixed-case files next to the lowercase ones of the last version.
+    """
+    renamed = 0
+    collisions = []
+    with os.scandir(path) as it:
+        entries = list(it)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            count, clashes = lowercase_tree(entry.path, replace)
+            renamed += count
+            collisions += clashes
+
+    names = set(entry.name for entry in entries)
+    for entry in entries:
+        lower = entry.name.lower()
+        if lower == entry.name:
+            continue
+        target = os.path.join(path, lower)
+        if lower in names and not replace:
+            collisions.append(entry.path)
+            continue
+        if lower in names and entry.is_dir(follow_symlinks=False) and os.path.isdir(target):
+            collisions += merge_tree(entry.path, target)
+            renamed += 1
+            continue
+        if lower in names and os.path.isdir(target):
+            collisions.append(entry.path)
+            continue
+        os.replace(entry.path, target)
+        names.add(lower)
+        renamed += 1
+    return renamed, collisions
+
+
+def has_mixed_case(path):
+    """ whether anything below path has a name the lowercase pass would change """
+    for root, dirs, files in os.walk(path):
+        if any(name != name.lower() for name in dirs + files):
+            return True
+    return False
+
+
+def tree_fingerprint(path):
+    """ cheap fingerprint of a mod folder built from the mtimes of its top two levels
+
+    Adding, removing or renaming entries bumps the mtime of the directory
+    holding them, which is what steamcmd does to the addons/keys folders
+    when a mod changes.
+    """
+    digest = hashlib.sha1()
+    stat = os.stat(path)
+    digest.update('{}:{}'.format(stat.st_ino, stat.st_mtime_ns).encode('utf-8'))
+    with os.scandir(path) as it:
+        for entry in sorted(it, key=lambda entry: entry.name):
+            if entry.is_dir(follow_symlinks=False):
+                digest.update('{}:{}'.format(entry.name, entry.stat(follow_symlinks=False).st_mtime_ns)
+                              .encode('utf-8'))
+    return digest.hexdigest()
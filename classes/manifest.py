@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_tree(root, prefix=''):
+    """ return {relative path: (size, mtime_ns)} for every file below root """
+    files = {}
+    with os.scandir(root) as it:
+        for entry in it:
+            relpath = prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                files.update(scan_tree(entry.path, relpath + '/'))
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                files[relpath] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+class manifest:
+    """Per mod list of files with size, mtime and content hash, kept in the database
+
+    Files whose size and mtime didn't change keep their stored hash, only
+    new or touched files are hashed again, spread over a process pool.
+    """
+
+    def __init__(self, conn, workers=None):
+        self.conn = conn
+        self.workers = workers
+
+    def load(self, steam_id):
+        c = self.conn.execute("SELECT path, size, mtime_ns, sha1 FROM mod_files WHERE steam_id = ?;",
+                              (steam_id,))
+        return dict((path, (size, mtime_ns, sha1)) for path, size, mtime_ns, sha1 in c.fetchall())
+
+    def has(self, steam_id):
+        return self.conn.execute("SELECT 1 FROM mod_files WHERE steam_id = ? LIMIT 1;",
+                                 (steam_id,)).fetchone() is not None
+
+    def newest_mtime(self, steam_id):
+        """ mtime of the newest file in seconds, unlike ctime it survives chmod and renames """
+        row = self.conn.execute("SELECT max(mtime_ns) FROM mod_files WHERE steam_id = ?;",
+                                (steam_id,)).fetchone()
+        return row[0] // 10 ** 9 if row[0] is not None else None
+
+    def update(self, trees):
+        """ rescan {steam_id: root} and return {steam_id: sorted relative paths that changed}
+
+        Changed covers added, modified and removed files.
+        """
+        scans = {}
+        jobs = []
+        for steam_id, root in trees.items():
+            old = self.load(steam_id)
+            new = {}
+            for relpath, (size, mtime_ns) in scan_tree(root).items():
+                previous = old.get(relpath)
+                if previous is not None and previous[:2] == (size, mtime_ns):
+                    new[relpath] = previous
+                else:
+                    new[relpath] = (size, mtime_ns, None)
+                    jobs.append((steam_id, relpath, os.path.join(root, relpath)))
+            scans[steam_id] = (old, new)
+
+        if jobs:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                hashes = executor.map(hash_file, [path for steam_id, relpath, path in jobs], chunksize=16)
+                for (steam_id, relpath, path), sha1 in zip(jobs, hashes):
+                    size, mtime_ns, _ = scans[steam_id][1][relpath]
+                    scans[steam_id][1][relpath] = (size, mtime_ns, sha1)
+
+        changes = {}
+        with self.conn:
+            for steam_id, (old, new) in scans.items():
+                changes[steam_id] = sorted(
+                    [relpath for relpath in new if old.get(relpath, (None,) * 3)[2] != new[relpath][2]]
+                    + [relpath for relpath in old if relpath not in new])
+                self.conn.execute("DELETE FROM mod_files WHERE steam_id = ?;", (steam_id,))
+                self.conn.executemany("INSERT INTO mod_files (steam_id, path, size, mtime_ns, sha1) "
+                                      "VALUES (?, ?, ?, ?, ?);",
+                                      [(steam_id, relpath) + entry for relpath, entry in new.items()])
+        return changes
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+import socket
+import time
+from urllib import error
+
+
+class metadata_cache:
+    """Workshop metadata cached in the mods table, steam is only asked once it went stale"""
+
+    # Seconds a cached field stays valid, overridden by cache_ttl in config.yaml
+    default_ttl = {'title': 7 * 24 * 3600,
+                   'time_updated': 300,
+                   'file_size': 24 * 3600}
+
+    def __init__(self, conn, api, ttl=None, refresh=False, offline=False):
+        self.conn = conn
+        self.api = api
+        self.ttl = dict(self.default_ttl)
+        self.ttl.update(ttl or {})
+        self.refresh = refresh
+        self.offline = offline
+
+    def load(self, mod_ids):
+        mod_ids = [int(mod_id) for mod_id in mod_ids]
+        rows = {}
+        c = self.conn.cursor()
+        # Stay well below sqlite's limit on bound parameters
+        for i in range(0, len(mod_ids), 500):
+            batch = mod_ids[i:i + 500]
+            c.execute("SELECT steam_id, title, time_updated, file_size, installed_at, checked_at "
+                      "FROM mods WHERE steam_id IN ({});".format(','.join('?' * len(batch))), batch)
+            for steam_id, title, time_updated, file_size, installed_at, checked_at in c.fetchall():
+                rows[steam_id] = {'title': title,
+                                  'time_updated': time_updated,
+                                  'file_size': file_size,
+                                  'installed_at': installed_at,
+                                  'checked_at': checked_at}
+        return rows
+
+    def is_stale(self, row, field, now):
+        if self.refresh or row is None or row[field] is None:
+            return True
+        return now - (row['checked_at'] or 0) > self.ttl[field]
+
+    def get(self, mod_ids, field):
+        """ return {steam_id: metadata} making sure field is no older than its ttl
+
+        Offline, or when steam can't be reached, whatever is cached is returned
+        and mods that were never looked up are missing from the result.
+        """
+        now = int(time.time())
+        rows = self.load(mod_ids)
+        stale = [int(mod_id) for mod_id in mod_ids if self.is_stale(rows.get(int(mod_id)), field, now)]
+        if not stale or self.offline:
+            return rows
+        try:
+            details = self.api.get_details(stale)
+        except (error.URLError, socket.timeout, ConnectionError, ValueError) as e:
+            print("!! Couldn't fetch workshop details, using cached data: {} !!".format(e))
+            return rows
+        self.store(details, now)
+        for steam_id, item in details.items():
+            row = rows.setdefault(steam_id, {'installed_at': None})
+            row.update({'title': item['title'],
+                        'time_updated': item['time_updated'],
+                        'file_size': item['file_size'],
+                        'checked_at': now})
+        return rows
+
+    def store(self, details, now):
+        self.conn.executemany("UPDATE mods SET title = ?, time_updated = ?, file_size = ?, checked_at = ? "
+                              "WHERE steam_id = ?;",
+                              [(item['title'], item['time_updated'], item['file_size'], now, steam_id)
+                               for steam_id, item in details.items()])
+        self.conn.commit()
+
+    def mark_installed(self, mod_ids, installed_at=None):
+        installed_at = installed_at or int(time.time())
+        self.conn.executemany("UPDATE mods SET installed_at = ? WHERE steam_id = ?;",
+                              [(installed_at, int(mod_id)) for mod_id in mod_ids])
+        self.conn.commit()
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+def timed(name):
+    """ decorator recording a function that takes ctx first as phase name """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(ctx, *args, **kwargs):
+            with ctx.metrics.phase(name):
+                return func(ctx, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class metrics:
+    """Phase timings and counters of a run
+
+    Written as one JSON line per run to the run log and as a Prometheus
+    textfile collector file per command, both optional.
+    """
+
+    def __init__(self, run_log=None, textfile_dir=None):
+        self.run_log = run_log
+        self.textfile_dir = textfile_dir
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.started_at = time.time()
+        self.phases = []
+        self.counters = Counter()
+        self.current = None
+
+    @contextmanager
+    def phase(self, name):
+        """ time the enclosed block, counters increased inside it are also kept per phase """
+        previous = self.current
+        self.current = {'name': name, 'seconds': 0.0, 'counters': Counter()}
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current['seconds'] = round(time.perf_counter() - start, 3)
+            self.phases.append(self.current)
+            self.current = previous
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+            if self.current is not None:
+                self.current['counters'][name] += value
+
+    def write_run_log(self, command):
+        entry = {'command': command,
+                 'started_at': self.started_at,
+                 'seconds': round(time.time() - self.started_at, 3),
+                 'phases': [dict(phase, counters=dict(phase['counters'])) for phase in self.phases],
+                 'counters': dict(self.counters)}
+        with open(self.run_log, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def write_textfile(self, command):
+        lines = ['# HELP arma3_utils_last_run_timestamp_seconds When the command last finished.',
+                 '# TYPE arma3_utils_last_run_timestamp_seconds gauge',
+                 'arma3_utils_last_run_timestamp_seconds{{command="{}"}} {:.0f}'.format(command, time.time()),
+                 '# HELP arma3_utils_last_run_duration_seconds Duration of the last run.',
+                 '# TYPE arma3_utils_last_run_duration_seconds gauge',
+                 'arma3_utils_last_run_duration_seconds{{command="{}"}} {:.3f}'.format(
+                     command, time.time() - self.started_at),
+                 '# HELP arma3_utils_phase_duration_seconds Duration of each phase of the last run.',
+                 '# TYPE arma3_utils_phase_duration_seconds gauge']
+        # Phases that ran once per config or instance are summed, a series may only appear once
+        durations = {}
+        for phase in self.phases:
+            durations[phase['name']] = durations.get(phase['name'], 0.0) + phase['seconds']
+        for name, seconds in durations.items():
+            lines.append('arma3_utils_phase_duration_seconds{{command="{}",phase="{}"}} {:.3f}'.format(
+                command, name, seconds))
+        for name, value in sorted(self.counters.items()):
+            lines.append('# TYPE arma3_utils_last_run_{} gauge'.format(name))
+            lines.append('arma3_utils_last_run_{}{{command="{}"}} {}'.format(name, command, value))
+        path = os.path.join(self.textfile_dir, 'arma3_utils_{}.prom'.format(command))
+        # The collector may read at any time, never let it see a half written file
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, path)
+
+    def write(self, command):
+        """ write the run log and textfile if configured, then start counting from zero """
+        if self.phases or self.counters:
+            try:
+                if self.run_log:
+                    self.write_run_log(command)
+                if self.textfile_dir:
+                    self.write_textfile(command)
+            except OSError as e:
+                print("!! Couldn't write metrics: {} !!".format(e))
+        self.clear()
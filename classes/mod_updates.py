@@ -0,0 +1,385 @@
+#!/usr/bin/python3
+import os
+import re
+from datetime import datetime
+from classes.lowercase import lowercase_tree, has_mixed_case, tree_fingerprint
+from classes.metrics import timed
+from classes.releases import replace_symlink, stage_releases, stage_copies, in_steamcmd_folder, activate_if_stopped
+
+KEY_PATTERN = re.compile(r'(key).*', re.I)
+
+def mod_needs_update(path, metadata, newest_mtime=None):
+    """ whether the workshop has something newer than the mod folder at path, which has to exist """
+    if metadata['time_updated'] is not None:
+        updated_at = datetime.fromtimestamp(metadata['time_updated'])
+        if metadata['installed_at'] is not None:
+            created_at = datetime.fromtimestamp(metadata['installed_at'])
+        elif newest_mtime is not None:
+            # chmod and the lowercase pass change ctime, file mtimes stay put
+            created_at = datetime.fromtimestamp(newest_mtime)
+        else:
+            created_at = datetime.fromtimestamp(os.path.getctime(path))
+
+        return updated_at >= created_at
+
+    return False
+
+@timed('check_for_updates')
+def check_for_updates(ctx, mods, installed=None):
+    """ look up all mods in bulk and return the set of mod ids that need a download
+
+    installed is the set of mod ids known to be on disk, without it every
+    mod folder is checked. The install time comes from the database, only
+    a mod that has neither an install time nor a file manifest gets its
+    folder's ctime looked up.
+    """
+    outdated = set()
+    present = []
+    for mod_name, mod_id in mods:
+        # A staged release is what the next restart runs, compare against that
+        path = ctx.mod_path(mod_id, staged=True)
+        on_disk = mod_id in installed if installed is not None else os.path.isdir(path)
+        if on_disk:
+            present.append((mod_name, mod_id, path))
+        else:
+            outdated.add(mod_id)
+
+    metadata = ctx.metadata.get([mod_id for mod_name, mod_id, path in present], 'time_updated')
+    for mod_name, mod_id, path in present:
+        if mod_id not in metadata or metadata[mod_id]['time_updated'] is None:
+            print("!! No workshop details for \"{}\" ({}) !!".format(mod_name, mod_id))
+        elif mod_needs_update(path, metadata[mod_id], ctx.manifest.newest_mtime(mod_id)):
+            outdated.add(mod_id)
+        else:
+            print("No update required for \"{}\" ({})... SKIPPING".format(mod_name, mod_id))
+    return outdated
+
+
+@timed('download')
+def download_mods(ctx, mod_ids, deadline=None):
+    """ download mod_ids into the staging area, returns ({steam_id: steamcmd folder}, failed, postponed)
+
+    Only items that failed are retried, see download_scheduler for the
+    order, the number of sessions and the deadline.
+    """
+    from classes.download_scheduler import download_scheduler
+    downloaded, failed, postponed = download_scheduler(ctx, deadline).run(mod_ids)
+    ctx.metrics.count('mods_downloaded', len(downloaded))
+    ctx.metrics.count('mods_failed', len(failed))
+    ctx.metrics.count('mods_postponed', len(postponed))
+    return downloaded, failed, postponed
+
+
+def update_mods(ctx, deadline=None):
+    return download_outdated(ctx, check_for_updates(ctx, ctx.mods), deadline)
+
+
+def download_outdated(ctx, outdated, deadline=None):
+    """ download and stage the mods in outdated, returns the ids that were staged
+
+    Mods that didn't make the deadline stay outdated, the next run gets them.
+    """
+    baseline = {}
+    for mod_name, mod_id in ctx.mods:
+        if mod_id not in outdated:
+            continue
+        print("Updating \"{}\" ({})".format(mod_name, mod_id))
+        path = ctx.mod_path(mod_id, staged=True)
+
+        # The new version is compared against this one to report the changes
+        if os.path.isdir(path) and not ctx.manifest.has(mod_id):
+            baseline[mod_id] = path
+
+    if baseline:
+        print("Indexing {} mod(s) before updating them...".format(len(baseline)))
+        ctx.manifest.update(baseline)
+    if not outdated:
+        return set()
+    # Downloads go to the staging area, the running server keeps its files untouched
+    downloaded, failed, postponed = download_mods(ctx, outdated, deadline)
+    downloaded = stage_releases(ctx, downloaded)
+    ctx.metadata.mark_installed(downloaded)
+    for mod_name, mod_id in ctx.mods:
+        if mod_id in failed:
+            print("!! Updating {} failed after {} tries !!".format(mod_name, ctx.steamcmd_retries))
+    if postponed:
+        print("{} update(s) postponed until the next run, they didn't fit before the deadline".format(len(postponed)))
+    return downloaded
+
+
+@timed('lowercase')
+def lowercase_workshop_dir(ctx, downloaded):
+    """ lowercase mods downloaded in this run or whose folder changed since the last pass """
+    fingerprints = dict(ctx.conn.execute('select steam_id, tree_fingerprint from mods;').fetchall())
+    paths = {}
+    for mod_name, mod_id in ctx.mods:
+        path = ctx.mod_path(mod_id, staged=True)
+        if not os.path.isdir(path):
+            continue
+        if mod_id not in downloaded and tree_fingerprint(path) == fingerprints.get(mod_id):
+            continue
+        paths[mod_id] = path
+    return lowercase_mods(ctx, paths, downloaded)
+
+
+def lowercase_mods(ctx, paths, downloaded=()):
+    """ lowercase the mod folders in {steam_id: path} and remember their fingerprints
+
+    A folder steamcmd downloads to is never renamed in, validate would
+    fetch every renamed entry again. Such a mod gets a release copy that
+    is lowercased instead, it goes live like a download.
+    """
+    copies = dict((mod_id, path) for mod_id, path in paths.items()
+                  if in_steamcmd_folder(ctx, path) and has_mixed_case(path))
+    if copies:
+        print("Copying {} mod(s) out of steamcmd's folder to lowercase them...".format(len(copies)))
+        paths = dict(paths)
+        paths.update(stage_copies(ctx, copies))
+    renamed = 0
+    changed = []
+    for mod_id, path in paths.items():
+        count, collisions = lowercase_tree(path, replace=mod_id in downloaded)
+        for collision in collisions:
+            print("!! Can't lowercase '{}', the lowercase name already exists !!".format(collision))
+        renamed += count
+        changed.append((tree_fingerprint(path), mod_id))
+    ctx.conn.executemany('update mods set tree_fingerprint = ? where steam_id = ?;', changed)
+    ctx.conn.commit()
+    ctx.metrics.count('files_renamed', renamed)
+    print("Renamed {} entries in {} mod(s)".format(renamed, len(changed)))
+    return renamed
+
+
+@timed('manifest')
+def report_changes(ctx, downloaded):
+    """ update the file manifests of downloaded mods and print which PBOs changed """
+    trees = {}
+    for mod_name, mod_id in ctx.mods:
+        path = ctx.mod_path(mod_id, staged=True)
+        if mod_id in downloaded and os.path.isdir(path):
+            trees[mod_id] = path
+    if not trees:
+        return {}
+    changes = ctx.manifest.update(trees)
+    ctx.metrics.count('files_changed', sum(len(paths) for paths in changes.values()))
+    for mod_name, mod_id in ctx.mods:
+        if mod_id not in changes:
+            continue
+        pbos = [path for path in changes[mod_id] if path.endswith('.pbo')]
+        print("{} file(s) changed in \"{}\" ({}), {} PBO(s){}".format(
+            len(changes[mod_id]), mod_name, mod_id, len(pbos),
+            ': ' + ', '.join(pbos) if pbos else ''))
+    return changes
+
+
+def scan_links(directory):
+    """ {name: symlink target} of everything in directory, None for entries that aren't symlinks """
+    linked = {}
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_symlink():
+                linked[entry.name] = os.readlink(entry.path)
+            else:
+                linked[entry.name] = None
+    return linked
+
+
+def mod_link_actions(ctx, linked, existing, skip=()):
+    """ [(action, link path, target)] that point the mod links of ctx at the install paths
+
+    linked is scan_links of the mod directory, existing the set of install
+    paths that are on disk. Mods in skip are left alone.
+    """
+    actions = []
+    for mod_name, mod_id in ctx.mods:
+        if mod_id in skip:
+            continue
+        link_path = "{}{}".format(ctx.mod_directory, mod_name)
+        real_path = ctx.mod_path(mod_id)
+        current = linked.get(str(mod_name), False)
+
+        if real_path not in existing:
+            print("Mod '{}' does not exist! ({})".format(mod_name, real_path))
+        elif current is False:
+            actions.append(('create', link_path, real_path))
+        elif current is None:
+            print("!! '{}' is not a symlink, leaving it alone !!".format(link_path))
+        elif current != real_path:
+            actions.append(('repoint', link_path, real_path))
+    return actions
+
+
+def apply_mod_links(ctx, actions):
+    for action, link_path, target in actions:
+        if action == 'create':
+            os.symlink(target, link_path)
+            print("Creating symlink '{}'...".format(link_path))
+        else:
+            replace_symlink(target, link_path)
+            print("Repointing symlink '{}'...".format(link_path))
+        ctx.metrics.count('mod_links_created')
+
+
+@timed('mod_symlinks')
+def create_mod_symlinks(ctx):
+    existing = set(path for path in (ctx.mod_path(mod_id) for mod_name, mod_id in ctx.mods)
+                   if os.path.isdir(path))
+    apply_mod_links(ctx, mod_link_actions(ctx, scan_links(ctx.mod_directory), existing))
+
+def index_keys(path):
+    """ return [(key name, key path)] for a mod folder, None if there is no key folder
+
+    Arma doesn't look into subfolders of the server's keys folder, keys
+    kept further down in the mod (Keys/Server/x.bikey) are found and
+    linked by their file name.
+    """
+    keyDirs = [x for x in os.listdir(path) if re.search(KEY_PATTERN, x)]
+    if not keyDirs:
+        return None
+    keyDir = keyDirs[0]
+    if os.path.isfile(os.path.join(path, keyDir)):
+        # Key is placed in root directory
+        return [(keyDir, os.path.join(path, keyDir))]
+    # Key is in a folder
+    keys = []
+    for root, dirs, files in os.walk(os.path.join(path, keyDir)):
+        dirs.sort()
+        keys += [(key, os.path.join(root, key)) for key in sorted(files)]
+    return keys
+
+
+def refresh_key_index(ctx, changed):
+    """ re-index the keys of mods that changed since they were last indexed
+
+    The index describes the live releases. Staged releases an instance was
+    already switched to are left out, copy_keys looks at those directly.
+    """
+    fingerprints = dict((steam_id, (tree_fingerprint, keys_fingerprint)) for steam_id, tree_fingerprint, keys_fingerprint
+                        in ctx.conn.execute('select steam_id, tree_fingerprint, keys_fingerprint from mods;'))
+    with ctx.conn:
+        for mod_name, mod_id in ctx.mods:
+            tree_fingerprint, keys_fingerprint = fingerprints.get(mod_id, (None, None))
+            if mod_id not in changed and keys_fingerprint is not None and keys_fingerprint == tree_fingerprint:
+                continue
+            if mod_id in ctx.switched_releases:
+                continue
+            real_path = ctx.mod_path(mod_id)
+            if not os.path.isdir(real_path):
+                print("Couldn't copy key for mod '{}', directory doesn't exist.".format(mod_name))
+                continue
+            keys = index_keys(real_path)
+            if keys is None:
+                print("!! Couldn't find key folder for mod {} !!".format(mod_name))
+            ctx.conn.execute('delete from mod_keys where steam_id = ?;', (mod_id,))
+            ctx.conn.executemany('insert or replace into mod_keys (steam_id, key_name, key_path) values (?, ?, ?);',
+                                 [(mod_id, key, key_path) for key, key_path in keys or []])
+            ctx.conn.execute('update mods set keys_fingerprint = ? where steam_id = ?;',
+                             (tree_fingerprint or '', mod_id))
+
+
+def wanted_keys(ctx, indexed=None):
+    """ {key name: key path} of the active config's mods, all mods without one
+
+    indexed is {steam_id: [(key name, key path)]} standing in for what the
+    key index holds about those mods.
+    """
+    from classes.presets import read_mod_folders
+    indexed = indexed or {}
+    active = set(read_mod_folders(ctx.config_path))
+    mod_ids = set(mod_id for mod_name, mod_id in ctx.mods if not active or str(mod_name) in active)
+    wanted = {}
+    for mod_id, key, key_path in ctx.conn.execute('select steam_id, key_name, key_path from mod_keys;'):
+        if mod_id in mod_ids and mod_id not in indexed:
+            wanted[key] = key_path
+    for mod_id, keys in indexed.items():
+        if mod_id in mod_ids:
+            wanted.update(keys)
+    return wanted
+
+
+def managed_roots(ctx):
+    """ folders the keys we link live in, with a trailing separator """
+    roots = [ctx.workshop_directory, ctx.staging_directory]
+    roots += list(ctx.install_paths.values()) + list(ctx.pending_releases.values())
+    return tuple(os.path.join(os.path.normpath(root), '') for root in roots)
+
+
+def key_actions(ctx, wanted, linked):
+    """ [(action, key, target)] that turn the linked keys into the wanted ones, removals first
+
+    Only links into mod folders we manage are removed or repointed, and
+    broken links. Keys linked by hand for local mods and regular files like
+    the vanilla a3.bikey are never touched.
+    """
+    roots = managed_roots(ctx)
+    actions = []
+    for key, target in linked.items():
+        if target is None or key in wanted:
+            continue
+        path = os.path.normpath(os.path.join(ctx.key_directory, target))
+        if path.startswith(roots) or not os.path.exists(path):
+            actions.append(('remove', key, target))
+    for key in sorted(wanted):
+        if key not in linked:
+            actions.append(('create', key, wanted[key]))
+        elif linked[key] is not None and linked[key] != wanted[key]:
+            # Repointed in place, the key must not go missing in between
+            actions.append(('repoint', key, wanted[key]))
+    return actions
+
+
+def apply_key_links(ctx, actions):
+    for action, key, target in actions:
+        path = os.path.join(ctx.key_directory, key)
+        if action == 'remove':
+            print("Removing outdated server key '{}'".format(key))
+            os.unlink(path)
+        elif action == 'repoint':
+            print("Repointing symlink to key '{}'".format(key))
+            replace_symlink(target, path)
+        else:
+            print("Creating symlink to key '{}'".format(key))
+            os.symlink(target, path)
+    added = [key for action, key, target in actions if action != 'remove']
+    removed = [key for action, key, target in actions if action == 'remove']
+    print("{} key(s) linked, {} removed".format(len(added), len(removed)))
+    ctx.metrics.count('keys_linked', len(added))
+    ctx.metrics.count('keys_removed', len(removed))
+    return added, removed
+
+
+@timed('copy_keys')
+def copy_keys(ctx, changed=()):
+    """ link the keys of the active config's mods (all mods without one) into the key directory
+
+    Our key symlinks that don't belong to any of those mods are removed,
+    see key_actions for what is left alone.
+    """
+    refresh_key_index(ctx, changed)
+    indexed = dict((mod_id, index_keys(path) or []) for mod_id, path in ctx.switched_releases.items()
+                   if os.path.isdir(path))
+    return apply_key_links(ctx, key_actions(ctx, wanted_keys(ctx, indexed), scan_links(ctx.key_directory)))
+
+
+def run_update(ctx, deadline=None):
+    """ the whole update_mods command, returns the ids of the mods that were downloaded
+
+    Mods are checked and downloaded once, the links are made for every instance.
+    """
+    print('Checking for updates...')
+    downloaded = update_mods(ctx, deadline)
+    print('Converting to lowercase...')
+    lowercase_workshop_dir(ctx, downloaded)
+    print('Comparing file manifests...')
+    report_changes(ctx, downloaded)
+    print('Activating staged updates...')
+    activate_if_stopped(ctx)
+    # The key index is shared, instances only differ in what they link
+    refresh_key_index(ctx, downloaded)
+    for instance in ctx.instances:
+        suffix = ' of {}'.format(instance.name) if len(ctx.instances) > 1 else ''
+        print('Creating symlinks for mod folders{}...'.format(suffix))
+        create_mod_symlinks(instance)
+        print('Creating symlinks for keys{}...'.format(suffix))
+        copy_keys(instance)
+    return downloaded
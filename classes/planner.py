@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+import json
+import os
+import time
+from classes.lowercase import tree_fingerprint
+from classes.metrics import timed
+from classes.mod_updates import (check_for_updates, download_outdated, lowercase_mods, report_changes, scan_links,
+                                 mod_link_actions, apply_mod_links, index_keys, wanted_keys, key_actions,
+                                 apply_key_links, refresh_key_index, copy_keys)
+from classes.presets import write_atomic
+from classes.releases import activate_if_stopped
+
+
+def existing_directories(paths):
+    """ the subset of paths that are directories, found with one scandir per parent folder """
+    listings = {}
+    existing = set()
+    for path in paths:
+        parent, name = os.path.split(path.rstrip(os.sep))
+        if parent not in listings:
+            listings[parent] = set()
+            try:
+                with os.scandir(parent) as it:
+                    listings[parent] = set(entry.name for entry in it if entry.is_dir())
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+        if name in listings[parent]:
+            existing.add(path)
+    return existing
+
+
+def count_mixed_case(path):
+    """ number of entries below path the lowercase pass would rename """
+    count = 0
+    for root, dirs, files in os.walk(path):
+        count += sum(1 for name in dirs + files if name != name.lower())
+    return count
+
+
+def lowercased_keys(path, keys):
+    """ what index_keys will find in path once the lowercase pass renamed it """
+    return [(key.lower(), os.path.join(path, os.path.relpath(key_path, path).lower())) for key, key_path in keys]
+
+
+@timed('plan')
+def make_plan(ctx):
+    """ everything update_mods would do, worked out from one look at the disk
+
+    Mod folders, mod links and key links are each listed once and the
+    workshop is asked about all mods in one lookup. The update check takes
+    the existence of the mod folders from that listing and their install
+    times from the database. To notice folders that need the lowercase
+    pass, tree_fingerprint still stats and lists every installed mod
+    folder, so even a plan with nothing to do touches each of them once.
+    Nothing is changed, the plan is a dict that survives a round trip
+    through JSON.
+    """
+    from classes.server import check_running
+    pending = dict(ctx.pending_releases)
+    staged = dict((mod_id, ctx.mod_path(mod_id, staged=True)) for mod_name, mod_id in ctx.mods)
+    live = dict((mod_id, ctx.mod_path(mod_id)) for mod_name, mod_id in ctx.mods)
+    switched = set(path for instance in ctx.instances for path in instance.switched_releases.values())
+    existing = existing_directories(set(staged.values()) | set(live.values()) | set(pending.values()) | switched)
+    installed = set(mod_id for mod_id, path in staged.items() if path in existing)
+
+    downloads = check_for_updates(ctx, ctx.mods, installed)
+
+    # The same choice activate_if_stopped makes: new mods go everywhere, the rest only to stopped instances
+    new_mods = set(mod_id for mod_id in pending if live[mod_id] not in existing)
+    activations = {}
+    for instance in ctx.instances:
+        stopped = not check_running(instance)
+        activations[instance.name] = sorted(mod_id for mod_id in pending if mod_id in new_mods or stopped
+                                            and instance.switched_releases.get(mod_id) != pending[mod_id])
+    activate = sorted(set(mod_id for mod_ids in activations.values() for mod_id in mod_ids))
+
+    fingerprints = dict((steam_id, (tree, keys)) for steam_id, tree, keys
+                        in ctx.conn.execute('select steam_id, tree_fingerprint, keys_fingerprint from mods;'))
+    lowercase = []
+    for mod_name, mod_id in ctx.mods:
+        # Downloads are lowercased once they're in
+        if mod_id in downloads or staged[mod_id] not in existing:
+            continue
+        fingerprint = tree_fingerprint(staged[mod_id])
+        if fingerprint != fingerprints.get(mod_id, (None, None))[0]:
+            lowercase.append({'steam_id': mod_id, 'path': staged[mod_id], 'fingerprint': fingerprint,
+                              'renames': count_mixed_case(staged[mod_id])})
+
+    # Keys of mods whose folder changes are indexed here instead of from the key index,
+    # and so are those of the staged releases an instance runs or is switched to
+    renamed = set(entry['path'] for entry in lowercase if entry['renames'])
+    retouched = set(entry['steam_id'] for entry in lowercase)
+    listed = {}
+    instances = []
+    for instance in ctx.instances:
+        indexed = {}
+        for mod_name, mod_id in ctx.mods:
+            tree, keys = fingerprints.get(mod_id, (None, None))
+            path = pending[mod_id] if mod_id in activations[instance.name] else instance.mod_path(mod_id)
+            if path == live[mod_id] and mod_id not in retouched and keys is not None and keys == tree:
+                continue
+            if path not in existing:
+                continue
+            if path not in listed:
+                keys = index_keys(path) or []
+                listed[path] = lowercased_keys(path, keys) if path in renamed else keys
+            indexed[mod_id] = listed[path]
+
+        # Activation switches the links of the mods it covers, new downloads get theirs from it as well
+        skip = set(activations[instance.name]) | set(mod_id for mod_id in downloads if live[mod_id] not in existing)
+        instances.append({
+            'name': instance.name,
+            'activate': activations[instance.name],
+            'mod_links': mod_link_actions(instance, scan_links(instance.mod_directory), existing, skip),
+            'key_links': key_actions(instance, wanted_keys(instance, indexed), scan_links(instance.key_directory)),
+        })
+
+    return {
+        'created_at': int(time.time()),
+        'downloads': sorted(downloads),
+        'lowercase': lowercase,
+        'activate': activate,
+        'instances': instances,
+    }
+
+
+def plan_is_empty(plan):
+    # Fingerprints of folders that changed without needing a rename are only bookkeeping
+    return not (plan['downloads'] or plan['activate'] or any(entry['renames'] for entry in plan['lowercase'])
+                or any(instance['mod_links'] or instance['key_links'] for instance in plan['instances']))
+
+
+def print_plan(ctx, plan):
+    if plan_is_empty(plan):
+        print('Nothing to do.')
+        return
+    names = dict((mod_id, mod_name) for mod_name, mod_id in ctx.mods)
+    for mod_id in plan['downloads']:
+        print("Download \"{}\" ({})".format(names.get(mod_id), mod_id))
+    for entry in plan['lowercase']:
+        if entry['renames']:
+            print("Lowercase {} entries in \"{}\" ({})".format(entry['renames'], names.get(entry['steam_id']),
+                                                              entry['steam_id']))
+    for instance in plan['instances']:
+        for mod_id in instance['activate']:
+            print("{}: Activate staged release of \"{}\" ({})".format(instance['name'], names.get(mod_id), mod_id))
+    for instance in plan['instances']:
+        for action, link_path, target in instance['mod_links']:
+            print("{}: {} symlink '{}' -> {}".format(instance['name'], action.capitalize(), link_path, target))
+        for action, key, target in instance['key_links']:
+            print("{}: {} key '{}'".format(instance['name'], action.capitalize(), key))
+    print("{} download(s), {} mod(s) to lowercase, {} activation(s), {} mod link(s), {} key change(s)".format(
+        len(plan['downloads']), sum(1 for entry in plan['lowercase'] if entry['renames']), len(plan['activate']),
+        sum(len(instance['mod_links']) for instance in plan['instances']),
+        sum(len(instance['key_links']) for instance in plan['instances'])))
+
+
+def save_plan(plan, path):
+    write_atomic(path, json.dumps(plan, indent=2).encode('utf-8'))
+
+
+def load_plan(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+@timed('apply')
+def apply_plan(ctx, plan, deadline=None):
+    """ carry out a plan from make_plan without looking at the disk again, returns the downloaded ids
+
+    Links are made exactly as planned. When mods were downloaded, or the
+    activations differ from the plan because a server started or stopped
+    in between, their keys can't be known in advance and are linked the
+    way update_mods does it.
+    """
+    fingerprints = [(entry['fingerprint'], entry['steam_id']) for entry in plan['lowercase'] if not entry['renames']]
+    with ctx.conn:
+        ctx.conn.executemany('update mods set tree_fingerprint = ? where steam_id = ?;', fingerprints)
+    if plan_is_empty(plan):
+        return set()
+
+    downloaded = set()
+    if plan['downloads']:
+        print('Downloading {} mod(s)...'.format(len(plan['downloads'])))
+        downloaded = download_outdated(ctx, set(plan['downloads']), deadline)
+    paths = dict((mod_id, ctx.mod_path(mod_id, staged=True)) for mod_id in downloaded)
+    for entry in plan['lowercase']:
+        if entry['renames'] and entry['steam_id'] not in downloaded:
+            paths[entry['steam_id']] = entry['path']
+    if paths:
+        print('Converting to lowercase...')
+        lowercase_mods(ctx, paths, downloaded)
+    if downloaded:
+        print('Comparing file manifests...')
+        report_changes(ctx, downloaded)
+    switched = {}
+    if plan['activate'] or downloaded:
+        print('Activating staged updates...')
+        switched = activate_if_stopped(ctx)
+    activated = set(mod_id for mod_ids in switched.values() for mod_id in mod_ids)
+
+    planned_keys = not downloaded and all(set(switched.get(entry['name'], ())) == set(entry['activate'])
+                                          for entry in plan['instances'])
+    refresh_key_index(ctx, downloaded | activated)
+    for entry in plan['instances']:
+        instance = ctx.instance(entry['name'])
+        if instance is None:
+            print('!! No instance called {} in config.yaml !!'.format(entry['name']))
+            continue
+        suffix = ' of {}'.format(instance.name) if len(ctx.instances) > 1 else ''
+        if entry['mod_links']:
+            print('Creating symlinks for mod folders{}...'.format(suffix))
+            apply_mod_links(instance, entry['mod_links'])
+        if planned_keys and entry['key_links']:
+            print('Creating symlinks for keys{}...'.format(suffix))
+            apply_key_links(instance, entry['key_links'])
+        elif not planned_keys:
+            print('Creating symlinks for keys{}...'.format(suffix))
+            copy_keys(instance)
+    return downloaded
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+import os
+from collections import Counter
+
+# Compared against the start of the log to notice a file that was truncated and regrew
+HEAD_SIZE = 256
+CHUNK_SIZE = 1024 * 1024
+
+
+class player_tracker:
+    """Keeps track of who is online by only parsing what was appended to the console log
+
+    The byte offset, inode and player set survive between runs in the
+    database, so every check only reads the new part of the log.
+    """
+
+    def __init__(self, conn, log_path, login_pattern, logout_pattern):
+        self.conn = conn
+        self.log_path = log_path
+        self.login_pattern = login_pattern
+        self.logout_pattern = logout_pattern
+
+    def load_state(self):
+        c = self.conn.cursor()
+        c.execute("SELECT inode, offset, head FROM log_state WHERE log_path = ?;", (self.log_path,))
+        row = c.fetchone()
+        c.execute("SELECT player, count FROM online_players WHERE log_path = ?;", (self.log_path,))
+        players = Counter(dict(c.fetchall()))
+        if row is None:
+            return None, 0, b'', players
+        return row[0], row[1], row[2] or b'', players
+
+    def save_state(self, inode, offset, head, players):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO log_state (log_path, inode, offset, head) "
+                              "VALUES (?, ?, ?, ?);", (self.log_path, inode, offset, head))
+            self.conn.execute("DELETE FROM online_players WHERE log_path = ?;", (self.log_path,))
+            self.conn.executemany("INSERT INTO online_players (log_path, player, count) VALUES (?, ?, ?);",
+                                  [(self.log_path, player, count) for player, count in players.items()])
+
+    def parse_line(self, line, players):
+        if self.login_pattern.match(line):
+            players[line.split(None, 3)[2]] += 1
+        elif self.logout_pattern.match(line):
+            player = line.split(None, 3)[2]
+            if players[player] > 0:
+                players[player] -= 1
+            if players[player] == 0:
+                del players[player]
+
+    def update(self):
+        """ parse whatever was appended since the last call and return the online players """
+        inode, offset, head, players = self.load_state()
+        with open(self.log_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            current_head = f.read(HEAD_SIZE)
+            # lgsm either moved the log away or truncated it, start over
+            if (stat.st_ino != inode or stat.st_size < offset
+                    or current_head[:len(head)] != head[:len(current_head)]):
+                offset = 0
+                players = Counter()
+            f.seek(offset)
+            rest = b''
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                lines = (rest + chunk).split(b'\n')
+                # The last piece may be a line that is still being written
+                rest = lines.pop()
+                for line in lines:
+                    # Logs written on Windows end their lines with \r\n, the patterns end at the dot
+                    self.parse_line(line.rstrip(b'\r').decode('utf-8', 'replace'), players)
+                offset += len(chunk)
+            offset -= len(rest)
+        self.save_state(stat.st_ino, offset, current_head, players)
+        return set(players)
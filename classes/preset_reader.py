@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+import re
+from html.parser import HTMLParser
+
+STEAM_ID_PATTERN = re.compile(r'[?&]id=(\d+)')
+
+
+class preset_reader(HTMLParser):
+    """Streaming reader for Arma 3 launcher preset files
+
+    Feed it the file in chunks, tags may span lines and chunk borders. Every
+    ModContainer row ends up in mods as a dict with the display name, the
+    steam id (None for local mods) and whether the mod is local.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.name = None
+        self.mods = []
+        self.mod = None
+        self.capture = None
+        self.text = ''
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'meta' and attrs.get('name') == 'arma:PresetName':
+            self.name = attrs.get('content')
+        elif tag == 'tr' and attrs.get('data-type') == 'ModContainer':
+            self.mod = {'name': '', 'steam_id': None, 'local': False}
+        elif tag == 'strong' and self.name is None and self.mod is None:
+            self.capture, self.text = 'preset_name', ''
+        elif self.mod is None:
+            return
+        elif tag == 'td' and attrs.get('data-type') == 'DisplayName':
+            self.capture, self.text = 'mod_name', ''
+        elif tag == 'span' and 'from-local' in (attrs.get('class') or ''):
+            self.mod['local'] = True
+        elif tag == 'a' and attrs.get('data-type') == 'Link':
+            match = STEAM_ID_PATTERN.search(attrs.get('href') or '')
+            if match:
+                self.mod['steam_id'] = match.group(1)
+
+    def handle_data(self, data):
+        if self.capture:
+            self.text += data
+
+    def handle_endtag(self, tag):
+        if tag == 'strong' and self.capture == 'preset_name':
+            self.name = self.text.strip()
+            self.capture = None
+        elif tag == 'td' and self.capture == 'mod_name':
+            self.mod['name'] = self.text.strip()
+            self.capture = None
+        elif tag == 'tr' and self.mod is not None:
+            if self.mod['local'] or self.mod['steam_id']:
+                self.mods.append(self.mod)
+            self.mod = None
+
+
+def read_preset(path, chunk_size=64 * 1024):
+    """ parse the preset at path and return (preset name, mods) """
+    reader = preset_reader()
+    with open(path, encoding='utf-8') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            reader.feed(chunk)
+    reader.close()
+    return reader.name, reader.mods
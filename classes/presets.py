@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+import gzip
+import html
+import os
+from string import Formatter
+from classes.metrics import timed
+
+
+def compile_template(text):
+    """ split a str.format template into (literal, field) pairs once, rendering is then a join """
+    return [(literal, field) for literal, field, spec, conversion in Formatter().parse(text)]
+
+
+def render(template, values):
+    return ''.join(literal + (values[field] if field is not None else '') for literal, field in template)
+
+
+PRESET_HEADER = compile_template(('<?xml version="1.0" encoding="utf-8"?>\n'
+                                  '<html>\n\n'
+                                  '<!--Created using arma3_utils by eviscares, based on the work of marceldev89 and Freddo3000.-->\n'
+                                  '<head>\n'
+                                  '<meta name="arma:Type" content="{type}" />\n'
+                                  '<meta name="arma:PresetName" content="{title}" />\n'
+                                  '<meta name="generator" content="arma3_utils"/>\n'
+                                  ' <title>Arma 3</title>\n'
+                                  '<link href="https://fonts.googleapis.com/css?family=Roboto" rel="stylesheet" type="text/css" />\n'
+                                  '<style>\n'
+                                  'body {{\n'
+                                  'margin: 0;\n'
+                                  'padding: 0;\n'
+                                  'color: #fff;\n'
+                                  'background: #000;\n'
+                                  '}}\n'
+                                  'body, th, td {{\n'
+                                  'font: 95%/1.3 Roboto, Segoe UI, Tahoma, Arial, Helvetica, sans-serif;\n'
+                                  '}}\n'
+                                  'td {{\n'
+                                  'padding: 3px 30px 3px 0;\n'
+                                  '}}\n'
+                                  'h1 {{\n'
+                                  'padding: 20px 20px 0 20px;\n'
+                                  'color: white;\n'
+                                  'font-weight: 200;\n'
+                                  'font-family: segoe ui;\n'
+                                  'font-size: 3em;\n'
+                                  'margin: 0;\n'
+                                  '}}\n'
+                                  'h2 {{'
+                                  'color: white;'
+                                  'padding: 20px 20px 0 20px;'
+                                  'margin: 0;'
+                                  '}}'
+                                  'em {{\n'
+                                  'font-variant: italic;\n'
+                                  'color:silver;\n'
+                                  '}}\n'
+                                  '.before-list {{\n'
+                                  'padding: 5px 20px 10px 20px;\n'
+                                  '}}\n'
+                                  '.mod-list {{\n'
+                                  'background: #282828;\n'
+                                  'padding: 20px;\n'
+                                  '}}\n'
+                                  '.optional-list {{\n'
+                                  'background: #222222;\n'
+                                  'padding: 20px;\n'
+                                  '}}\n'
+                                  '.dlc-list {{\n'
+                                  'background: #222222;\n'
+                                  'padding: 20px;\n'
+                                  '}}\n'
+                                  '.footer {{\n'
+                                  'padding: 20px;\n'
+                                  'color:gray;\n'
+                                  '}}\n'
+                                  '.whups {{\n'
+                                  'color:gray;\n'
+                                  '}}\n'
+                                  'a {{\n'
+                                  'color: #D18F21;\n'
+                                  'text-decoration: underline;\n'
+                                  '}}\n'
+                                  'a:hover {{\n'
+                                  'color:#F1AF41;\n'
+                                  'text-decoration: none;\n'
+                                  '}}\n'
+                                  '.from-steam {{\n'
+                                  'color: #449EBD;\n'
+                                  '}}\n'
+                                  '.from-local {{\n'
+                                  'color: gray;\n'
+                                  '}}\n'
+                                  '</style>\n'
+                                  '</head>\n'
+                                  '<body>\n'
+                                  '<h1>Arma 3  - {type} <strong>{title}</strong></h1>\n'
+                                  '<p class="before-list">\n'
+                                  '<em>Drag this file or link to it to Arma 3 Launcher or open it Mods / Preset / Import.</em>\n'
+                                  '</p>\n'
+                                  '<h2 class="list-heading">Required Mods</h2>'
+                                  '<div class="mod-list">\n'
+                                  '<table>\n'))
+
+PRESET_ROW = compile_template(('<tr data-type="ModContainer">\n'
+                               '<td data-type="DisplayName">{title}</td>\n'
+                               '<td>\n'
+                               '<span class="from-steam">Steam</span>\n'
+                               '</td>\n'
+                               '<td>\n'
+                               '<a href="{url}" data-type="Link">{url}</a>\n'
+                               '</td>\n'
+                               '</tr>\n'))
+
+PRESET_FOOTER = ('</table>\n'
+                 '</div>\n'
+                 '<div class="footer">\n'
+                 '<span>Created using arma3_utils by eviscares, based on the work of marceldev89 and Freddo3000.</span>\n'
+                 '</div>\n'
+                 '</body>\n'
+                 '</html>\n')
+
+# Hand written configs use .cfg, convert_modlist writes .conf
+CONFIG_EXTENSIONS = ('.cfg', '.conf')
+
+
+def read_mod_folders(config_path):
+    """ folder names in the mods= line of a server config, [] without config """
+    if not os.path.isfile(config_path):
+        return []
+    with open(config_path) as f:
+        for line in f:
+            if line.startswith('mods='):
+                mod_line = line.strip('mods=').replace('\"','').strip().replace('mods/','').replace('\\','').split(';')
+                return [mod for mod in mod_line if mod]
+    return []
+
+def read_modlist(ctx, config_path):
+    """ {'title': preset title, folder name: steam id} of a server config """
+    prev_line = ''
+    comment_line = ''
+    mod_list = {}
+    with open(config_path) as f:
+        for line in f:
+            if line.startswith('mods='):
+                mod_line = line
+                if prev_line.startswith('#'):
+                    comment_line = prev_line
+            prev_line = line
+    if comment_line:
+        mod_list['title'] = comment_line.strip('#').strip()
+    mod_line = mod_line.strip('mods=').replace('\"','').strip().replace('mods/','').replace('\\','').split(';')
+    mod_line.remove('')
+
+    # Folder names are in the database, only mods linked by hand need a readlink
+    steam_ids = dict((str(mod_name), str(mod_id)) for mod_name, mod_id in ctx.mods)
+    for mod in mod_line:
+        if mod in steam_ids:
+            mod_list[mod] = steam_ids[mod]
+        else:
+            mod_list[mod] = os.readlink('{}{}'.format(ctx.mod_directory, mod)).split('/')[-1]
+    return mod_list
+
+def generate_modlist(ctx):
+    return read_modlist(ctx, ctx.config_path)
+
+def write_atomic(path, data):
+    """ write data next to path and rename it over path, readers never see a partial file """
+    temp_path = '{}.tmp{}'.format(path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def preset_filename(mod_list):
+    if 'title' in mod_list:
+        return '{}.html'.format(mod_list['title'].replace(' ', '_').lower())
+    return 'modlist.html'
+
+def render_preset(mod_list, metadata):
+    """ the launcher preset html of mod_list, with titles taken from metadata """
+    title = html.escape(mod_list.get('title', ''))
+    parts = [render(PRESET_HEADER, {'type': 'Modpack', 'title': title})]
+    for mod_name, mod_id in mod_list.items():
+        if mod_name == 'title':
+            continue
+        if int(mod_id) in metadata and metadata[int(mod_id)]['title'] is not None:
+            mod_url = "http://steamcommunity.com/sharedfiles/filedetails/?id={}".format(mod_id)
+            parts.append(render(PRESET_ROW, {'title': html.escape(metadata[int(mod_id)]['title']),
+                                             'url': mod_url}))
+        else:
+            print("!! Couldn't find title for mod {} !!".format(mod_id))
+    parts.append(PRESET_FOOTER)
+    return ''.join(parts).encode('utf-8')
+
+@timed('generate_preset')
+def generate_preset(ctx, mod_list, metadata=None, filename=None):
+    """ write the preset of mod_list to the modlist directory, returns its path """
+    modlist_path = ctx.modlist_dir + (filename or preset_filename(mod_list))
+    if metadata is None:
+        metadata = ctx.metadata.get([mod_id for mod_name, mod_id in mod_list.items() if mod_name != 'title'],
+                                    'title')
+    try:
+        write_atomic(modlist_path, render_preset(mod_list, metadata))
+        ctx.metrics.count('presets_written')
+    except (OSError, IOError):
+        print('Problem writing to {}'.format(modlist_path))
+    return modlist_path
+
+def publish_preset(ctx, modlist_path):
+    """ copy a preset into the web root together with a gzip copy for static serving """
+    with open(modlist_path, 'rb') as f:
+        data = f.read()
+    web_path = ctx.web_root + os.path.basename(modlist_path)
+    try:
+        write_atomic(web_path, data)
+        # mtime=0 keeps the .gz identical between runs when nothing changed
+        write_atomic(web_path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    except (OSError, IOError):
+        print('Problem writing to {}'.format(web_path))
+
+@timed('generate_all_presets')
+def generate_all_presets(ctx):
+    """ write the presets of every config in the mod config folder, titles are looked up once
+
+    Both .cfg files and the .conf files convert_modlist writes count as
+    configs. When two configs share a title the later one is named after
+    its config file instead of overwriting the first preset.
+    """
+    mod_lists = []
+    filenames = set()
+    for config_name in sorted(os.listdir(ctx.mod_config_folder)):
+        stem, extension = os.path.splitext(config_name)
+        if extension not in CONFIG_EXTENSIONS:
+            continue
+        mod_list = read_modlist(ctx, ctx.mod_config_folder + config_name)
+        # Without a title every config would end up as modlist.html
+        mod_list.setdefault('title', stem)
+        filename = preset_filename(mod_list)
+        if filename in filenames:
+            fallback = preset_filename({'title': stem})
+            print("!! {} has the same title as another config, writing its preset to {} instead of {} !!".format(
+                config_name, fallback, filename))
+            filename = fallback
+        filenames.add(filename)
+        mod_lists.append((mod_list, filename))
+
+    mod_ids = set(mod_id for mod_list, filename in mod_lists
+                  for mod_name, mod_id in mod_list.items() if mod_name != 'title')
+    metadata = ctx.metadata.get(mod_ids, 'title')
+    publish = os.path.isdir(ctx.web_root)
+    for mod_list, filename in mod_lists:
+        modlist_path = generate_preset(ctx, mod_list, metadata, filename)
+        if publish and os.path.isfile(modlist_path):
+            publish_preset(ctx, modlist_path)
+    print("Generated {} preset(s) for {} mod(s)".format(len(mod_lists), len(mod_ids)))
+    return len(mod_lists)
+
+def activate_config(ctx, config_name):
+    config_to_activate = ctx.mod_config_folder + config_name
+    try:
+        os.symlink(config_to_activate, ctx.config_path)
+    except FileExistsError:
+        os.remove(ctx.config_path)
+        os.symlink(config_to_activate, ctx.config_path)
+    # Only the keys of the mods in the new config should stay linked
+    from classes.mod_updates import copy_keys
+    copy_keys(ctx)
+    generate_preset(ctx, generate_modlist(ctx))
+    modlist = ctx.modlist_dir + config_name.replace('cfg', 'html')
+    if os.path.isdir(ctx.web_root) and os.path.isfile(modlist):
+        if os.path.islink(ctx.web_root + 'modlist.html') and not os.path.exists(ctx.web_root + 'modlist.html'):
+            print('Removing old modlist.')
+            os.unlink(ctx.web_root + 'modlist.html')
+        print('Linking {} to {}'.format(modlist, ctx.web_root + 'modlist.html' ))
+        try:
+            os.symlink(modlist, ctx.web_root)
+        except PermissionError:
+            print('Can not link, check your permissions.')
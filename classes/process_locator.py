@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+import os
+import psutil
+
+
+class process_locator:
+    """Finds the server process, without walking the process table when possible
+
+    The pid found last time is checked first, then the pid file, and only
+    if neither points at a live server process are all processes scanned.
+
+    Every lgsm instance runs the same game binary, they're told apart by
+    the server config passed with -config=. A server started without one
+    can't be told apart and counts as any instance's.
+    """
+
+    def __init__(self, process_name, pid_file=None, server_config=None):
+        self.process_name = process_name.lower()
+        self.pid_file = pid_file
+        self.server_config = server_config.lower() if server_config else None
+        self.pid = None
+
+    def is_binary(self, name, cmdline):
+        if name and self.process_name in name.lower():
+            return True
+        # Linux truncates process names to 15 characters, the binary path isn't
+        return bool(cmdline) and self.process_name in os.path.basename(cmdline[0]).lower()
+
+    def matches(self, name, cmdline):
+        if not self.is_binary(name, cmdline):
+            return False
+        configs = [arg.split('=', 1)[1] for arg in (cmdline or [])[1:] if arg.lower().startswith('-config=')]
+        if not configs or self.server_config is None:
+            return True
+        return any(os.path.basename(config).lower() == self.server_config for config in configs)
+
+    def is_server(self, pid):
+        try:
+            proc = psutil.Process(pid)
+            return self.matches(proc.name(), proc.cmdline())
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            return False
+
+    def read_pid_file(self):
+        if not self.pid_file:
+            return None
+        try:
+            with open(self.pid_file) as f:
+                return int(f.read().split()[0])
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def find(self):
+        """ return the pid of the running server or None """
+        if self.pid is not None and self.is_server(self.pid):
+            return self.pid
+        pid = self.read_pid_file()
+        if pid is not None and self.is_server(pid):
+            self.pid = pid
+            return pid
+        self.pid = None
+        for proc in psutil.process_iter(attrs=['name', 'cmdline']):
+            if self.matches(proc.info['name'], proc.info['cmdline']):
+                self.pid = proc.pid
+                break
+        return self.pid
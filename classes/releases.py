@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+import os
+import shutil
+import subprocess
+import time
+from classes.metrics import timed
+
+
+def replace_symlink(target, link_path):
+    """ point link_path at target in one rename, it never goes missing in between """
+    temp_path = os.path.join(os.path.dirname(link_path), '.{}.tmp'.format(os.path.basename(link_path)))
+    if os.path.lexists(temp_path):
+        os.unlink(temp_path)
+    os.symlink(target, temp_path)
+    os.replace(temp_path, link_path)
+
+
+def steamcmd_directory(ctx, worker=0):
+    """ steamcmd's install dir for staged downloads, the live mods are never written to
+
+    It stays around as a download cache, so validate only fetches what
+    changed since the last download. Concurrent steamcmd sessions would
+    trip over each other's state, every further session gets a folder of
+    its own.
+    """
+    return os.path.join(ctx.staging_directory, 'steamcmd-{}'.format(worker) if worker else 'steamcmd')
+
+
+def releases_directory(ctx):
+    return os.path.join(ctx.staging_directory, 'releases')
+
+
+def new_release_path(ctx, mod_id, staged_at):
+    # The folder keeps the steam id as its name, generate_modlist reads it from the link target
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(staged_at))
+    path = os.path.join(releases_directory(ctx), stamp, str(mod_id))
+    suffix = 1
+    while os.path.exists(path):
+        path = os.path.join(releases_directory(ctx), '{}-{}'.format(stamp, suffix), str(mod_id))
+        suffix = suffix + 1
+    return path
+
+
+def copy_tree(source, target):
+    """ copy the folder source to target, as reflinks where the filesystem supports them """
+    try:
+        # Only cp knows how to reflink, on btrfs or xfs that makes the copy nearly free
+        subprocess.run(['cp', '-a', '--reflink=auto', source, target], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError):
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, target, symlinks=True)
+
+
+def remove_release(ctx, path):
+    """ delete a release folder, anything outside the releases directory is left alone """
+    root = releases_directory(ctx) + os.sep
+    if not path.startswith(root) or path == root:
+        return
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
+
+
+def in_steamcmd_folder(ctx, path):
+    """ whether path is in a folder steamcmd downloads to, renaming anything there makes validate fetch it again """
+    path = os.path.join(os.path.normpath(path), '')
+    if path.startswith(os.path.join(releases_directory(ctx), '')):
+        return False
+    return path.startswith((os.path.join(os.path.normpath(ctx.workshop_directory), ''),
+                            os.path.join(os.path.normpath(ctx.staging_directory), '')))
+
+
+@timed('stage')
+def stage_releases(ctx, downloaded):
+    """ copy fresh downloads out of steamcmd's folder into a release each, returns the staged ids
+
+    downloaded is {steam_id: steamcmd folder it was downloaded to}. The
+    download stays where steamcmd put it, so the next update of the mod
+    is patched there instead of fetched in full.
+    """
+    sources = {}
+    for mod_id in sorted(downloaded):
+        source = ctx.steamcmd.content_path(downloaded[mod_id], mod_id)
+        if not os.path.isdir(source):
+            print("!! steamcmd reported {} as downloaded, but {} doesn't exist !!".format(mod_id, source))
+            continue
+        sources[mod_id] = source
+    return set(stage_copies(ctx, sources))
+
+
+def stage_copies(ctx, sources):
+    """ copy the mod folders in {steam_id: folder} into a release each, returns {steam_id: release}
+
+    A release that was staged earlier but never went live is replaced.
+    """
+    staged_at = int(time.time())
+    staged = {}
+    for mod_id in sorted(sources):
+        path = new_release_path(ctx, mod_id, staged_at)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        copy_tree(sources[mod_id], path)
+        staged[mod_id] = path
+
+    # Never went live anywhere, nothing is using it. One an instance was already switched to stays until
+    # that instance moves on to the new one
+    superseded = [ctx.pending_releases[mod_id] for mod_id in staged if mod_id in ctx.pending_releases
+                  and not switched_instances(ctx, ctx.pending_releases[mod_id])]
+    with ctx.conn:
+        ctx.conn.executemany('delete from releases where path = ?;', [(path,) for path in superseded])
+        ctx.conn.executemany('insert into releases (steam_id, path, staged_at) values (?, ?, ?);',
+                             [(mod_id, path, staged_at) for mod_id, path in staged.items()])
+    for path in superseded:
+        remove_release(ctx, path)
+    forget_releases(ctx)
+    ctx.metrics.count('mods_staged', len(staged))
+    return staged
+
+
+def switched_instances(ctx, path):
+    """ names of the instances that were switched to the staged release at path """
+    return set(name for name, in ctx.conn.execute('select instance from release_instances where path = ?;',
+                                                  (path,)))
+
+
+def forget_releases(ctx):
+    ctx.reset('install_paths', 'pending_releases')
+    for instance in ctx.instances:
+        instance.reset('switched_releases')
+
+
+def prune_releases(ctx, mod_ids):
+    """ keep the newest keep_releases activated versions of mod_ids, including the live one """
+    keep = max(ctx.keep_releases, 1)
+    for mod_id in mod_ids:
+        paths = [path for path, in ctx.conn.execute('select path from releases '
+                                                    'where steam_id = ? and activated_at is not null '
+                                                    'order by activated_at desc, rowid desc;', (mod_id,))]
+        for path in paths[keep:]:
+            if path == ctx.mod_path(mod_id):
+                continue
+            with ctx.conn:
+                ctx.conn.execute('delete from releases where path = ?;', (path,))
+            remove_release(ctx, path)
+
+
+@timed('activate')
+def activate_releases(ctx, mod_ids=None, instances=None):
+    """ point the mod links of instances (all without) at staged releases, of all mods or only of mod_ids
+
+    Links are swapped with a rename, so no server ever sees a missing mod.
+    Instances that aren't in instances keep running what they run now. A
+    release goes live, and older ones are pruned, only once every instance
+    was switched to it. Returns the ids that were switched in any of
+    instances, their keys still need to be linked there.
+    """
+    instances = ctx.instances if instances is None else instances
+    pending = dict((mod_id, path) for mod_id, path in ctx.pending_releases.items()
+                   if mod_ids is None or mod_id in mod_ids)
+    if not pending:
+        return set()
+    switched_at = int(time.time())
+    # What goes back in place on a rollback
+    live = dict((mod_id, ctx.mod_path(mod_id)) for mod_id in pending)
+    switched = set()
+    for instance in instances:
+        for mod_name, mod_id in ctx.mods:
+            if mod_id not in pending or instance.switched_releases.get(mod_id) == pending[mod_id]:
+                continue
+            link_path = "{}{}".format(instance.mod_directory, mod_name)
+            # A real folder in the mod directory isn't ours to replace
+            if os.path.islink(link_path) or not os.path.exists(link_path):
+                replace_symlink(pending[mod_id], link_path)
+                print("Switched '{}' to {}".format(link_path, pending[mod_id]))
+            with ctx.conn:
+                ctx.conn.execute('insert or ignore into release_instances (path, instance, switched_at) '
+                                 'values (?, ?, ?);', (pending[mod_id], instance.name, switched_at))
+            switched.add(mod_id)
+
+    everyone = set(instance.name for instance in ctx.instances)
+    complete = dict((mod_id, path) for mod_id, path in pending.items()
+                    if everyone <= switched_instances(ctx, path))
+    superseded = []
+    with ctx.conn:
+        for mod_id, path in complete.items():
+            ctx.conn.execute('update releases set activated_at = ?, previous_path = ? where path = ?;',
+                             (switched_at, live[mod_id], path))
+            ctx.conn.execute('insert or replace into install_paths (steam_id, path) values (?, ?);',
+                             (mod_id, path))
+            ctx.conn.execute('delete from release_instances where path = ?;', (path,))
+            # Releases it replaced before they reached every instance aren't run anywhere anymore
+            superseded += [path for path, in ctx.conn.execute('select path from releases where steam_id = ? '
+                                                              'and activated_at is null;', (mod_id,))]
+            ctx.conn.execute('delete from releases where steam_id = ? and activated_at is null;', (mod_id,))
+    forget_releases(ctx)
+    for path in superseded:
+        remove_release(ctx, path)
+    if len(complete) < len(pending) and switched:
+        print("{} staged update(s) go live once the other instances restart".format(len(pending) - len(complete)))
+    ctx.metrics.count('mods_activated', len(complete))
+    prune_releases(ctx, complete)
+    return switched
+
+
+def activate_staged(ctx, mod_ids=None, instances=None):
+    """ switch instances (all without) to staged releases and relink their keys """
+    from classes.mod_updates import copy_keys
+    instances = ctx.instances if instances is None else instances
+    activated = activate_releases(ctx, mod_ids, instances)
+    if activated:
+        for instance in instances:
+            copy_keys(instance, activated)
+    return activated
+
+
+def activate_if_stopped(ctx):
+    """ switch the stopped instances to every staged release, running ones only to mods they don't have yet
+
+    Returns {instance name: ids switched in that instance}.
+    """
+    from classes.server import check_running
+    stopped = [instance for instance in ctx.instances if not check_running(instance)]
+    new_mods = [mod_id for mod_id in ctx.pending_releases if not os.path.isdir(ctx.mod_path(mod_id))]
+    # No instance runs a mod it doesn't have yet, those go everywhere
+    activated = activate_releases(ctx, new_mods) if new_mods else set()
+    switched = dict((instance.name, set(activated)) for instance in ctx.instances)
+    for instance in stopped:
+        switched[instance.name] |= activate_releases(ctx, instances=[instance])
+    if ctx.pending_releases:
+        print("{} staged update(s) go live with the next restart".format(len(ctx.pending_releases)))
+    return switched
+
+
+@timed('rollback')
+def rollback_releases(ctx, mod_ids=None):
+    """ point mods back at the version that was live before their current release
+
+    Without mod_ids the mods of the last activation are rolled back. The
+    release that's rolled back is removed, returns the ids that were
+    rolled back.
+    """
+    explicit = bool(mod_ids)
+    if not explicit:
+        # Everything that went live with the last activation
+        mod_ids = set(mod_id for mod_id, in ctx.conn.execute(
+            'select steam_id from releases where activated_at = (select max(activated_at) from releases);'))
+    rolled_back = {}
+    for mod_name, mod_id in ctx.mods:
+        if mod_id not in mod_ids:
+            continue
+        current = ctx.mod_path(mod_id)
+        row = ctx.conn.execute('select previous_path from releases '
+                               'where path = ? and activated_at is not null;', (current,)).fetchone()
+        if row is None or not row[0] or not os.path.isdir(row[0]):
+            if explicit:
+                print("!! No previous version of \"{}\" ({}) to roll back to !!".format(mod_name, mod_id))
+            continue
+        with ctx.conn:
+            ctx.conn.execute('delete from releases where path = ?;', (current,))
+            ctx.conn.execute('insert or replace into install_paths (steam_id, path) values (?, ?);',
+                             (mod_id, row[0]))
+        for instance in ctx.instances:
+            # An instance that already runs a newer staged release keeps it
+            if mod_id in instance.switched_releases:
+                continue
+            link_path = "{}{}".format(instance.mod_directory, mod_name)
+            if os.path.islink(link_path) or not os.path.exists(link_path):
+                replace_symlink(row[0], link_path)
+        print("Rolled back \"{}\" ({}) to {}".format(mod_name, mod_id, row[0]))
+        rolled_back[mod_id] = current
+    forget_releases(ctx)
+    if rolled_back:
+        from classes.mod_updates import copy_keys
+        for instance in ctx.instances:
+            copy_keys(instance, rolled_back)
+    for path in rolled_back.values():
+        remove_release(ctx, path)
+    ctx.metrics.count('mods_rolled_back', len(rolled_back))
+    return set(rolled_back)
@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+import os
+import re
+import subprocess
+from classes.metrics import timed
+from classes.player_tracker import player_tracker
+
+LOGIN_PATTERN = re.compile(r'^\s\d+\:\d+\:\d+\s(Player)\s.*(connecting)\.$')
+LOGOUT_PATTERN = re.compile(r'^\s\d+\:\d+\:\d+\s(Player)\s.*\s(disconnected)\.$')
+
+def check_running(ctx):
+    return ctx.process_locator.find() is not None
+
+def check_empty(ctx):
+    tracker = player_tracker(ctx.conn, ctx.log_path, LOGIN_PATTERN, LOGOUT_PATTERN)
+    players = tracker.update()
+    if len(players) == 0:
+        return True
+    else:
+        return False
+
+def restart(ctx, instances=None):
+    """ restart instances (just ctx without) at the same time """
+    from classes.releases import activate_staged
+    instances = instances or [ctx]
+    # Swap in staged updates right before the restart, the server is only down for the restart itself.
+    # Instances that keep running stay on what they run
+    activate_staged(ctx, instances=instances)
+    # lgsm restarts take a while and instances don't depend on each other
+    processes = [subprocess.Popen([instance.lgsm_binary, 'restart']) for instance in instances]
+    for process in processes:
+        process.wait()
+    ctx.metrics.count('restarts', len(processes))
+
+@timed('restart_server')
+def restart_server(ctx, args, instances=None):
+    """ restart the empty ones of instances (just ctx without), every running one with --force """
+    to_restart = []
+    stopped = []
+    for instance in instances or [ctx]:
+        if instance.config['lgsm_binary'] != '' and os.path.isfile(instance.lgsm_binary):
+            if check_running(instance):
+                print("{} is running. Parsing logs to see if it is empty.".format(instance.lgsm_binary))
+                if check_empty(instance) or args.force:
+                    to_restart.append(instance)
+                else:
+                    print('Server not empty and --force not supplied.')
+            else:
+                stopped.append(instance)
+                print('{} is not running.'.format(instance.lgsm_binary))
+        else:
+            print('No lgsm binary configured, or binary not found. \
+                 Can not automatically restart.')
+    if to_restart:
+        restart(ctx, to_restart)
+    if stopped:
+        # Their next start picks up the staged updates
+        from classes.releases import activate_staged
+        activate_staged(ctx, instances=stopped)
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+import os
+
+
+class lazy_property:
+    """Computes the value on first access and keeps it on the instance"""
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = self.func(obj)
+        setattr(obj, self.func.__name__, value)
+        return value
+
+
+class shared_property:
+    """Reads the value from the parent settings so it's loaded only once for all instances"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        return getattr(obj.parent, self.name)
+
+
+class settings:
+    """Configuration, database and clients shared by the commands
+
+    Nothing is loaded until it's first used, so a command only pays for the
+    parts it touches and the package can be imported as a library.
+    """
+
+    def __init__(self, config_file='config.yaml', db_file='arma3_utils.db', refresh=False, offline=False):
+        self.config_file = config_file
+        self.db_file = db_file
+        self.refresh = refresh
+        self.offline = offline
+
+    def reset(self, *names):
+        """ forget cached values so they're loaded again on next access """
+        for name in names:
+            self.__dict__.pop(name, None)
+
+    @lazy_property
+    def config(self):
+        import yaml
+        # Load Config from yaml file to make it more user friendly
+        with open(self.config_file) as file:
+            return yaml.load(file, Loader=yaml.FullLoader)
+
+    @lazy_property
+    def name(self):
+        return self.config.get('name') or self.config['lgsm_binary']
+
+    @lazy_property
+    def instances(self):
+        """ one settings per lgsm server in config.yaml, just this one without an instances section """
+        if not self.config.get('instances'):
+            return [self]
+        return [instance(self, instance_config) for instance_config in self.config['instances']]
+
+    def instance(self, name=None):
+        """ the instance called name, the first one without a name, None if there is no such instance """
+        for candidate in self.instances:
+            if name is None or candidate.name == name:
+                return candidate
+        return None
+
+    @lazy_property
+    def conn(self):
+        from classes.arma3_db import arma3_db
+        return arma3_db(self.db_file, self.config.get('db_busy_timeout', 30)).connect()
+
+    @lazy_property
+    def mods(self):
+        """ (folder name, steam_id) of every mod in the database """
+        return self.conn.execute('select coalesce(f.folder_name, m.rowid), m.steam_id from mods m '
+                                 'left join mod_folders f on f.steam_id = m.steam_id '
+                                 'order by m.rowid;').fetchall()
+
+    @lazy_property
+    def install_paths(self):
+        """ steam_id -> folder for mods that don't live in the workshop directory """
+        return dict(self.conn.execute('select steam_id, path from install_paths;').fetchall())
+
+    @lazy_property
+    def pending_releases(self):
+        """ steam_id -> staged folder that goes live with the next restart """
+        # A release superseded while some instance runs it stays until it's replaced there too
+        return dict(self.conn.execute('select steam_id, path from releases '
+                                      'where activated_at is null order by staged_at, rowid;').fetchall())
+
+    @lazy_property
+    def switched_releases(self):
+        """ steam_id -> staged folder this instance already runs while other instances don't yet """
+        if self not in self.instances:
+            return {}
+        return dict(self.conn.execute('select r.steam_id, r.path from release_instances i '
+                                      'join releases r on r.path = i.path '
+                                      'where i.instance = ? and r.activated_at is null '
+                                      'order by i.switched_at, i.rowid;', (self.name,)).fetchall())
+
+    def mod_path(self, mod_id, staged=False):
+        """ folder the server uses for mod_id, or with staged its newest downloaded version """
+        if staged and mod_id in self.pending_releases:
+            return self.pending_releases[mod_id]
+        if mod_id in self.switched_releases:
+            return self.switched_releases[mod_id]
+        if mod_id in self.install_paths:
+            return self.install_paths[mod_id]
+        return "{}/{}".format(self.workshop_directory, mod_id)
+
+    @lazy_property
+    def base_path(self):
+        return self.config['paths']['base_path']
+
+    @lazy_property
+    def mod_directory(self):
+        return self.base_path + self.config['paths']['mod_directory']
+
+    @lazy_property
+    def key_directory(self):
+        return self.base_path + self.config['paths']['key_directory']
+
+    @lazy_property
+    def config_path(self):
+        return self.base_path + self.config['paths']['config_file']
+
+    @lazy_property
+    def staging_directory(self):
+        # steamcmd downloads below steamcmd/, finished versions are renamed into releases/
+        return self.base_path + self.config['paths'].get('staging_dir', 'mod_staging/')
+
+    @lazy_property
+    def keep_releases(self):
+        # The live version and the one before it, for rollback
+        return self.config.get('keep_releases', 2)
+
+    @lazy_property
+    def modlist_dir(self):
+        return self.base_path + self.config['paths']['modlist_dir']
+
+    @lazy_property
+    def mod_config_folder(self):
+        return self.base_path + self.config['paths']['mod_config_folder']
+
+    @lazy_property
+    def lgsm_binary(self):
+        return self.base_path + self.config['lgsm_binary']
+
+    @lazy_property
+    def workshop_directory(self):
+        return self.config['paths']['workshop_dir'] + str(self.config['arma3_workshop_id'])
+
+    @lazy_property
+    def pid_file(self):
+        pid_file = self.config['paths'].get('pid_file')
+        return self.base_path + pid_file if pid_file else None
+
+    @lazy_property
+    def process_locator(self):
+        """ kept for the lifetime of the settings so the server pid is cached between checks """
+        from classes.process_locator import process_locator
+        return process_locator(self.config.get('server_binary') or 'arma3server', self.pid_file, self.server_config)
+
+    @lazy_property
+    def server_config(self):
+        """ file name of the game's server config, lgsm passes <selfname>.server.cfg with -config= """
+        server_config = self.config['paths'].get('server_config')
+        if server_config:
+            return os.path.basename(server_config)
+        return '{}.server.cfg'.format(os.path.basename(self.config['lgsm_binary']))
+
+    @lazy_property
+    def log_path(self):
+        return self.base_path + self.config['paths']['log_path']
+
+    @lazy_property
+    def web_root(self):
+        # This is only for serving your modlist via webserver
+        return self.config['paths']['web_root']
+
+    @lazy_property
+    def steamcmd_retries(self):
+        # Only items that failed are retried, waiting steamcmd_backoff * 2^n in between
+        return self.config.get('steamcmd_retries', 5)
+
+    @lazy_property
+    def steamcmd_backoff(self):
+        return self.config.get('steamcmd_backoff', 5)
+
+    @lazy_property
+    def metrics(self):
+        from classes.metrics import metrics
+        # Both outputs are optional, without them timings are only kept in memory
+        config = self.config.get('metrics') or {}
+        return metrics(config.get('run_log'), config.get('textfile_dir'))
+
+    @lazy_property
+    def manifest(self):
+        from classes.manifest import manifest
+        # None lets the process pool use every cpu
+        return manifest(self.conn, self.config.get('hash_workers'))
+
+    @lazy_property
+    def steamcmd(self):
+        from classes.steamcmd import steamcmd
+        return steamcmd(self.config['steam_cmd'], self.config['user']['username'],
+                        self.config['user']['password'], self.config['arma3_workshop_id'],
+                        self.metrics)
+
+    @lazy_property
+    def steam_api(self):
+        from classes.steam_api import steam_api
+        # Metadata lookups run concurrently, these keep them bounded and polite
+        return steam_api(self.config['steam_api_url'],
+                         self.config.get('http_timeout', 10),
+                         self.config.get('http_retries', 3),
+                         self.config.get('http_backoff', 1),
+                         self.config.get('update_check_workers', 8),
+                         self.metrics)
+
+    @lazy_property
+    def metadata(self):
+        from classes.metadata_cache import metadata_cache
+        return metadata_cache(self.conn, self.steam_api, self.config.get('cache_ttl'),
+                              self.refresh, self.offline)
+
+
+class instance(settings):
+    """One of several lgsm servers listed under instances in config.yaml
+
+    Its entries override the top level config, paths are merged key by
+    key. The database, workshop cache, staging area and clients are those
+    of the parent, so mods are checked and downloaded once for all
+    instances.
+    """
+
+    conn = shared_property('conn')
+    instances = shared_property('instances')
+    mods = shared_property('mods')
+    install_paths = shared_property('install_paths')
+    pending_releases = shared_property('pending_releases')
+    workshop_directory = shared_property('workshop_directory')
+    staging_directory = shared_property('staging_directory')
+    metrics = shared_property('metrics')
+    manifest = shared_property('manifest')
+    steamcmd = shared_property('steamcmd')
+    steam_api = shared_property('steam_api')
+    metadata = shared_property('metadata')
+
+    def __init__(self, parent, instance_config):
+        super().__init__(parent.config_file, parent.db_file, parent.refresh, parent.offline)
+        self.parent = parent
+        config = dict(parent.config)
+        config.pop('instances')
+        for key, value in instance_config.items():
+            if key == 'paths':
+                config['paths'] = dict(parent.config['paths'], **value)
+            else:
+                config[key] = value
+        self.config = config
+
+    def reset(self, *names):
+        self.parent.reset(*[name for name in names if isinstance(getattr(type(self), name, None), shared_property)])
+        super().reset(*names)
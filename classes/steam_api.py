@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+import json
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib import request, error, parse
+
+
+def fetch_url(url, data=None, timeout=10, retries=3, backoff=1):
+    """ fetch url and return the decoded body, retrying with exponential backoff """
+    tries = 0
+    while True:
+        try:
+            with request.urlopen(url, data=data, timeout=timeout) as response:
+                return response.read().decode("utf-8")
+        except error.HTTPError as e:
+            # Client errors won't go away by asking again
+            if (e.code < 500 and e.code != 429) or tries >= retries:
+                raise
+        except (error.URLError, socket.timeout, ConnectionError):
+            if tries >= retries:
+                raise
+        time.sleep(backoff * 2 ** tries)
+        tries = tries + 1
+
+
+class steam_api:
+    """Bulk workshop metadata lookups through the published file details API"""
+
+    # The API refuses more items than this in a single request
+    batch_size = 100
+
+    def __init__(self, url, timeout=10, retries=3, backoff=1, workers=8, metrics=None):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.workers = workers
+        self.metrics = metrics
+
+    def _fetch_batch(self, mod_ids):
+        form = {'itemcount': len(mod_ids)}
+        for i, mod_id in enumerate(mod_ids):
+            form['publishedfileids[{}]'.format(i)] = mod_id
+        body = fetch_url(self.url, parse.urlencode(form).encode('utf-8'),
+                         self.timeout, self.retries, self.backoff)
+        if self.metrics:
+            self.metrics.count('http_requests')
+            self.metrics.count('http_bytes', len(body))
+        return json.loads(body).get('response', {}).get('publishedfiledetails', [])
+
+    def get_details(self, mod_ids):
+        """ return {steam_id: details} for every id steam knows about
+
+        details holds title, time_updated, file_size and the steam ids of
+        required items as dependencies. Ids steam doesn't return (removed,
+        private, ...) are missing from the result.
+        """
+        mod_ids = sorted(set(int(mod_id) for mod_id in mod_ids))
+        batches = [mod_ids[i:i + self.batch_size] for i in range(0, len(mod_ids), self.batch_size)]
+        details = {}
+        if not batches:
+            return details
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(batches))) as executor:
+            for items in executor.map(self._fetch_batch, batches):
+                for item in items:
+                    if item.get('result') != 1:
+                        continue
+                    details[int(item['publishedfileid'])] = {
+                        'title': item.get('title', ''),
+                        'time_updated': int(item.get('time_updated', 0)),
+                        'file_size': int(item.get('file_size', 0)),
+                        'dependencies': [int(child['publishedfileid'])
+                                         for child in item.get('children', [])],
+                    }
+        return details
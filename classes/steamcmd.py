@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+import os
+import re
+import shlex
+import signal
+import subprocess
+import tempfile
+import threading
+
+# steamcmd reports the outcome of every workshop_download_item on its own line
+SUCCESS_PATTERN = re.compile(r'Success\. Downloaded item (\d+)(?:.*\((\d+) bytes\))?')
+FAILURE_PATTERN = re.compile(r'ERROR! (?:Download item|Timeout downloading item) (\d+)')
+
+
+class steamcmd:
+    """Downloads many workshop items in a single steamcmd session"""
+
+    def __init__(self, binary, username, password, app_id, metrics=None):
+        self.binary = binary
+        self.username = username
+        self.password = password
+        self.app_id = app_id
+        self.metrics = metrics
+
+    def content_path(self, install_dir, mod_id):
+        """ where a download ends up when steamcmd was pointed at install_dir """
+        return os.path.join(install_dir, 'steamapps', 'workshop', 'content', str(self.app_id), str(mod_id))
+
+    def write_script(self, mod_ids, script, install_dir=None, throttle=None):
+        script.write('@ShutdownOnFailedCommand 0\n')
+        script.write('@NoPromptForPassword 1\n')
+        if install_dir:
+            # Has to come before login or steamcmd ignores it
+            script.write('force_install_dir {}\n'.format(install_dir))
+        if throttle:
+            script.write('set_download_throttle {}\n'.format(throttle))
+        script.write('login {} {}\n'.format(self.username, self.password))
+        for mod_id in mod_ids:
+            script.write('workshop_download_item {} {} validate\n'.format(self.app_id, mod_id))
+        script.write('quit\n')
+
+    @staticmethod
+    def stop(process):
+        # steamcmd.sh starts the real binary as a child, stop the whole group
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def download(self, mod_ids, install_dir=None, throttle=None, timeout=None, on_success=None):
+        """ download mod_ids in one session and return (succeeded, failed) sets of ids
+
+        An item only counts as downloaded if steamcmd reported success for it,
+        anything without a success line is treated as failed. Without
+        install_dir items go to steamcmd's own workshop directory. throttle
+        caps the session's bandwidth in kbps, after timeout seconds steamcmd
+        is stopped and what it didn't finish counts as failed. on_success is
+        called with the id of every item as soon as steamcmd reports it.
+        """
+        succeeded = set()
+        # NamedTemporaryFile is only readable by us, the script holds the password
+        with tempfile.NamedTemporaryFile('w', prefix='arma3_utils_', suffix='.txt', delete=False) as script:
+            self.write_script(mod_ids, script, install_dir, throttle)
+        try:
+            process = subprocess.Popen(shlex.split(self.binary) + ['+runscript', script.name],
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       universal_newlines=True, start_new_session=timeout is not None)
+            timer = threading.Timer(max(timeout, 0), self.stop, (process,)) if timeout is not None else None
+            if timer:
+                timer.start()
+            for line in process.stdout:
+                print(line, end='')
+                match = SUCCESS_PATTERN.search(line)
+                if match:
+                    succeeded.add(int(match.group(1)))
+                    if self.metrics and match.group(2):
+                        self.metrics.count('bytes_downloaded', int(match.group(2)))
+                    if on_success:
+                        on_success(int(match.group(1)))
+                    continue
+                match = FAILURE_PATTERN.search(line)
+                if match:
+                    succeeded.discard(int(match.group(1)))
+            process.wait()
+            if timer:
+                timer.cancel()
+            if self.metrics:
+                self.metrics.count('steamcmd_runs')
+        finally:
+            os.remove(script.name)
+        print("")
+        succeeded &= set(int(mod_id) for mod_id in mod_ids)
+        return succeeded, set(int(mod_id) for mod_id in mod_ids) - succeeded
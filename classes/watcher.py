@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+import json
+import os
+import time
+import traceback
+from datetime import datetime
+from classes.mod_updates import run_update
+from classes.releases import activate_staged
+from classes.server import check_running, check_empty, restart
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+class watcher:
+    """Long running replacement for the cron jobs
+
+    Checks for updates every update_interval seconds and, when asked to,
+    restarts every instance as soon as its console log shows it went empty
+    after an update. Config, database, cached metadata and the server pid
+    stay loaded between cycles.
+    """
+
+    def __init__(self, ctx, restart_when_empty=False):
+        self.ctx = ctx
+        self.restart_when_empty = restart_when_empty
+        watch_config = ctx.config.get('watch') or {}
+        self.update_interval = watch_config.get('update_interval', 3600)
+        self.poll_interval = watch_config.get('poll_interval', 5)
+        self.status_file = watch_config.get('status_file', 'arma3_utils_status.json')
+        # A failed update check is tried again this much sooner than a regular one
+        self.retry_interval = watch_config.get('retry_interval', 300)
+        self.next_update = time.time()
+        # Names of the instances that still need a restart
+        self.pending_restarts = set()
+        self.last_update = None
+        self.last_restarts = {}
+        self.last_error = None
+        self.inotify = None
+        if INotify is not None:
+            try:
+                self.inotify = INotify()
+                # Watch the folders so a rotated log is noticed too
+                for log_dir in set(os.path.dirname(instance.log_path) for instance in self.ctx.instances):
+                    self.inotify.add_watch(log_dir, flags.MODIFY | flags.CREATE | flags.MOVED_TO)
+            except OSError as e:
+                print("Can't watch the console log, polling instead: {}".format(e))
+                self.inotify = None
+
+    def write_status(self):
+        status = {
+            'updated_at': datetime.now().isoformat(),
+            'next_update_check': datetime.fromtimestamp(self.next_update).isoformat(),
+            'pending_actions': ['restart {}'.format(name) for name in sorted(self.pending_restarts)],
+            'last_update': self.last_update,
+            'last_restarts': self.last_restarts,
+            'last_error': self.last_error,
+        }
+        temp_file = self.status_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(status, f, indent=2)
+        os.replace(temp_file, self.status_file)
+
+    def update(self):
+        # Pick up mods that were added since the last cycle
+        self.ctx.reset('mods', 'install_paths')
+        downloaded = run_update(self.ctx)
+        self.ctx.metrics.write('update_mods')
+        self.last_update = {'finished_at': datetime.now().isoformat(),
+                            'downloaded': sorted(downloaded)}
+        if downloaded and self.restart_when_empty:
+            self.pending_restarts = set(instance.name for instance in self.ctx.instances)
+        self.next_update = time.time() + self.update_interval
+
+    def try_restart(self):
+        for instance in self.ctx.instances:
+            if instance.name not in self.pending_restarts:
+                continue
+            if not check_running(instance):
+                print('{} not running, activating staged updates for its next start.'.format(instance.name))
+                activate_staged(self.ctx, instances=[instance])
+                self.pending_restarts.discard(instance.name)
+            elif check_empty(instance):
+                print('{} is empty, restarting...'.format(instance.name))
+                with self.ctx.metrics.phase('restart_server'):
+                    restart(self.ctx, [instance])
+                self.ctx.metrics.write('restart_server')
+                self.last_restarts[instance.name] = datetime.now().isoformat()
+                self.pending_restarts.discard(instance.name)
+
+    def log_stat(self):
+        stats = []
+        for instance in self.ctx.instances:
+            try:
+                stat = os.stat(instance.log_path)
+                stats.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stats.append(None)
+        return stats
+
+    def wait(self, timeout):
+        """ sleep up to timeout seconds, waking early when a console log changes """
+        if not self.pending_restarts:
+            time.sleep(timeout)
+        elif self.inotify is not None:
+            self.inotify.read(timeout=int(timeout * 1000))
+        else:
+            deadline = time.time() + timeout
+            before = self.log_stat()
+            while time.time() < deadline and self.log_stat() == before:
+                time.sleep(min(self.poll_interval, max(deadline - time.time(), 0)))
+
+    def failed(self, action, e):
+        """ log an error of one cycle, the watcher keeps going """
+        traceback.print_exc()
+        print('!! {} failed: {} !!'.format(action, e))
+        self.last_error = {'at': datetime.now().isoformat(), 'action': action,
+                           'error': '{}: {}'.format(type(e).__name__, e)}
+        # Timings of the half finished run would end up in the next one
+        self.ctx.metrics.clear()
+
+    def cycle(self):
+        """ one round of update check and restarts, errors are logged and recorded in the status file """
+        if time.time() >= self.next_update:
+            try:
+                self.update()
+            except Exception as e:
+                self.failed('update', e)
+                self.next_update = time.time() + min(self.retry_interval, self.update_interval)
+        if self.pending_restarts:
+            try:
+                self.try_restart()
+            except Exception as e:
+                # The restarts stay pending, the next change of a console log tries again
+                self.failed('restart', e)
+        try:
+            self.write_status()
+        except OSError as e:
+            print("!! Can't write {}: {} !!".format(self.status_file, e))
+
+    def run(self):
+        while True:
+            self.cycle()
+            self.wait(max(self.next_update - time.time(), 0))
@@ -1,16 +1,20 @@
 #!/usr/bin/python3
-import sqlite3
 import yaml
 import os
 import errno
 import io
+import socket
 from argparse import ArgumentParser
 from sqlite3 import Error
 from collections import defaultdict
+from urllib import error
+from classes.arma3_db import arma3_db
+from classes.preset_reader import read_preset
+from classes.steam_api import steam_api
 
 def parse_args():
     parser = ArgumentParser()
-    parser.add_argument('-f', '--filename', help='Name of html modlist to parse', required=True)
+    parser.add_argument('-f', '--filename', help='Name(s) of html modlist(s) to parse', required=True, nargs='+')
     parser.add_argument('-d', help='Debugmode', dest='debugmode', action='store_true')
     return parser.parse_args()
 
@@ -18,8 +22,7 @@ def parse_args():
 def load_config(args):
     if not args.debugmode:
         with open('config.yaml') as file:
-            config = yaml.load(file)
-        #config = yaml.load(file, Loader=yaml.FullLoader)
+            config = yaml.load(file, Loader=yaml.FullLoader)
         return config
     else:
         config = defaultdict(dict)
@@ -30,22 +33,56 @@ def load_config(args):
         return config
 
 
-def get_folder_name(mod_id, conn):
-    folder_name = ''
-    c = conn.cursor()
+def get_folder_names(mod_ids, conn):
+    """ return {steam_id: folder name}, adding unknown mods to the database in one transaction """
+    folder_names = {}
+    mod_ids = [int(mod_id) for mod_id in mod_ids]
     try:
-        c.execute('select rowid from mods where steam_id = {};'.format(mod_id))
-        row = c.fetchone()
-        if row is not None:
-            folder_name = row
-        else:
-            c.execute('insert into mods (steam_id) values ({});'.format(mod_id))
-            conn.commit()
-            c.execute('select rowid from mods where steam_id={};'.format(mod_id))
-            folder_name = c.fetchone()
+        with conn:
+            conn.executemany('insert or ignore into mods (steam_id) values (?);',
+                             [(mod_id,) for mod_id in mod_ids])
+            # New mods are linked by their rowid, like the ones imported before
+            conn.executemany('insert or ignore into mod_folders (steam_id, folder_name) '
+                             'select steam_id, cast(rowid as text) from mods where steam_id = ?;',
+                             [(mod_id,) for mod_id in mod_ids])
+            # Stay well below sqlite's limit on bound parameters
+            for i in range(0, len(mod_ids), 500):
+                batch = mod_ids[i:i + 500]
+                c = conn.execute('select steam_id, folder_name from mod_folders where steam_id in ({});'.format(
+                    ','.join('?' * len(batch))), batch)
+                folder_names.update(c.fetchall())
     except Error as e:
         print(e)
-    return folder_name[0]
+    return folder_names
+
+
+def resolve_mods(mod_ids, config):
+    """ look the preset up on steam, warn about unavailable mods and add missing dependencies """
+    if not config.get('steam_api_url'):
+        return mod_ids
+    api = steam_api(config['steam_api_url'], config.get('http_timeout', 10),
+                    config.get('http_retries', 3), config.get('http_backoff', 1))
+    resolved = list(mod_ids)
+    to_lookup = list(mod_ids)
+    while to_lookup:
+        try:
+            details = api.get_details(to_lookup)
+        except (error.URLError, socket.timeout, ConnectionError, ValueError) as e:
+            print('Couldn\'t fetch workshop details: {}'.format(e))
+            return resolved
+        dependencies = []
+        for mod_id in to_lookup:
+            if int(mod_id) not in details:
+                print('!! Mod {} is not available on the workshop !!'.format(mod_id))
+                continue
+            print('{} ({})'.format(details[int(mod_id)]['title'], mod_id))
+            for dependency in details[int(mod_id)]['dependencies']:
+                if str(dependency) not in resolved:
+                    print('Adding missing dependency {} of {}'.format(dependency, details[int(mod_id)]['title']))
+                    resolved.append(str(dependency))
+                    dependencies.append(dependency)
+        to_lookup = dependencies
+    return resolved
 
 
 def write_config(folder_names, config_name, env):
@@ -82,26 +119,26 @@ def write_config(folder_names, config_name, env):
 
 
 def main():
-    download_link_line='<a href=\"http://steamcommunity.com/sharedfiles/filedetails/?id='
-    mod_ids = []
-    folder_names = []
-    conn = sqlite3.connect('arma3_utils.db')
     args = parse_args()
     config = load_config(args)
-    with open('modlist.html') as file:
-        for line in file:
-            if '<h1>' in line:
-                modlist_name = line.lstrip().split('<strong>')[1].replace('</strong></h1>', '').rstrip()
-                print(modlist_name)
-            if download_link_line in line:
-                line = line.lstrip()
-                id = line.split()[1].split('=')[2].replace('\"','')
-                mod_ids.append(id)
-
-    for mod_id in mod_ids:
-        folder_names.append(get_folder_name(mod_id, conn))
-    config_written = write_config (folder_names, modlist_name, config)
-    print(config_written)
+    presets = []
+    for filename in args.filename:
+        modlist_name, mods = read_preset(filename)
+        if not modlist_name:
+            modlist_name = os.path.splitext(os.path.basename(filename))[0]
+        print(modlist_name)
+        mod_ids = resolve_mods([mod['steam_id'] for mod in mods if not mod['local']], config)
+        local_mods = [mod['name'] for mod in mods if mod['local']]
+        presets.append((modlist_name, mod_ids, local_mods))
+
+    conn = arma3_db('arma3_utils.db').connect()
+    # Keep the preset order so new mods get their folder numbers in that order
+    all_ids = list(dict.fromkeys(mod_id for name, mod_ids, local_mods in presets for mod_id in mod_ids))
+    folder_names = get_folder_names(all_ids, conn)
+    for modlist_name, mod_ids, local_mods in presets:
+        config_written = write_config([folder_names[int(mod_id)] for mod_id in mod_ids if int(mod_id) in folder_names]
+                                      + local_mods, modlist_name, config)
+        print(config_written)
     conn.close()
 
 
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'bench'))
+
+import fake_steam
+import fixtures
+from classes.settings import settings
+
+FAKE_STEAMCMD = os.path.join(REPO_DIR, 'tools', 'fake_steamcmd.py')
+
+
+def url(server):
+    return 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+@pytest.fixture
+def steam():
+    """ start(**options) runs a fake Steam for the test and returns the server """
+    servers = []
+
+    def start(**options):
+        servers.append(fake_steam.start(**options))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def server(tmp_path, steam, monkeypatch):
+    """ make(count, outdated=()) builds a synthetic server with count mods and returns its settings """
+    contexts = []
+
+    def make(count, outdated=(), **steam_options):
+        base_path = str(tmp_path / 'server')
+        workshop_dir = str(tmp_path / 'workshop')
+        fixtures.build_server(base_path, count)
+        fixtures.build_workshop(workshop_dir, count, 2, 16)
+        fixtures.build_database(str(tmp_path / 'arma3_utils.db'), count)
+        fixtures.write_config(str(tmp_path / 'config.yaml'), base_path, workshop_dir,
+                              url(steam(outdated=outdated, **steam_options)), FAKE_STEAMCMD)
+        monkeypatch.setenv('FAKE_STEAMCMD_ROOT', str(tmp_path / 'steamcmd'))
+        ctx = settings(str(tmp_path / 'config.yaml'), str(tmp_path / 'arma3_utils.db'))
+        contexts.append(ctx)
+        return ctx
+    yield make
+    for ctx in contexts:
+        if 'conn' in ctx.__dict__:
+            ctx.conn.close()
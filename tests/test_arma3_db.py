@@ -0,0 +1,88 @@
+import sqlite3
+import threading
+
+import pytest
+
+from classes.arma3_db import arma3_db
+
+
+def tables(conn):
+    return set(name for name, in conn.execute("select name from sqlite_master where type = 'table';"))
+
+
+def test_fresh_database_gets_every_migration(tmp_path):
+    db = arma3_db(str(tmp_path / 'arma3_utils.db'))
+    conn = db.connect()
+    assert conn.execute('PRAGMA user_version;').fetchone()[0] == len(db.migrations())
+    assert conn.execute('PRAGMA journal_mode;').fetchone()[0] == 'wal'
+    assert {'mods', 'mod_folders', 'install_paths', 'mod_keys', 'releases', 'log_files'} <= tables(conn)
+    assert not {'configs', 'config_mods'} & tables(conn)
+    conn.close()
+
+
+def test_database_from_before_migrations_keeps_its_mods(tmp_path):
+    path = str(tmp_path / 'arma3_utils.db')
+    legacy = sqlite3.connect(path)
+    legacy.execute('create table mods (steam_id integer unique);')
+    legacy.executemany('insert into mods values (?);', [(450814997,), (463939057,)])
+    legacy.commit()
+    legacy.close()
+
+    conn = arma3_db(path).connect()
+    assert conn.execute('select steam_id, title from mods order by rowid;').fetchall() == \
+        [(450814997, None), (463939057, None)]
+    # Mods were linked by their rowid before folder names existed
+    assert conn.execute('select steam_id, folder_name from mod_folders order by steam_id;').fetchall() == \
+        [(450814997, '1'), (463939057, '2')]
+    conn.close()
+
+
+def test_connecting_again_changes_nothing(tmp_path):
+    db = arma3_db(str(tmp_path / 'arma3_utils.db'))
+    conn = db.connect()
+    conn.execute('insert into mods (steam_id) values (1);')
+    conn.commit()
+    conn.close()
+    conn = db.connect()
+    assert conn.execute('select count(*) from mods;').fetchone()[0] == 1
+    assert conn.execute('PRAGMA user_version;').fetchone()[0] == len(db.migrations())
+    conn.close()
+
+
+def test_failed_migration_is_rolled_back(tmp_path):
+    class broken_db(arma3_db):
+        def broken(self, c):
+            c.execute('create table half_done (x integer);')
+            raise sqlite3.OperationalError('broken migration')
+
+        def migrations(self):
+            return super().migrations() + [self.broken]
+
+    path = str(tmp_path / 'arma3_utils.db')
+    with pytest.raises(sqlite3.OperationalError):
+        broken_db(path).connect()
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA user_version;').fetchone()[0] == len(arma3_db(path).migrations())
+    assert 'half_done' not in tables(conn)
+    conn.close()
+
+
+def test_concurrent_first_connects(tmp_path):
+    path = str(tmp_path / 'arma3_utils.db')
+    errors = []
+    versions = []
+
+    def connect():
+        try:
+            conn = arma3_db(path).connect()
+            versions.append(conn.execute('PRAGMA user_version;').fetchone()[0])
+            conn.close()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=connect) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert versions == [len(arma3_db(path).migrations())] * 4
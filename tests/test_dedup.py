@@ -0,0 +1,92 @@
+import os
+
+import fixtures
+from classes.dedup import dedup, dedup_trees, find_duplicates, link_group
+from classes.releases import stage_copies
+
+BLOCK = 8192
+
+
+def release(ctx, tmp_path, mod_id, files):
+    """ stage a release of mod_id holding files, {relative path: content} """
+    source = tmp_path / 'sources' / str(mod_id)
+    for relpath, content in files.items():
+        path = source / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return stage_copies(ctx, {mod_id: str(source)})[mod_id]
+
+
+def inodes(root):
+    found = {}
+    for folder, dirs, files in os.walk(root):
+        for name in files:
+            path = os.path.join(folder, name)
+            found[os.path.relpath(path, root)] = os.stat(path).st_ino
+    return found
+
+
+def test_only_releases_are_deduplicated(server, tmp_path):
+    ctx = server(3)
+    first, second, third = fixtures.mod_ids(3)
+    # The synthetic mods live in the workshop folder, a later validate could patch them in place
+    assert dedup_trees(ctx) == {}
+    path = release(ctx, tmp_path, second, {'addons/a.pbo': b'a' * BLOCK})
+    assert dedup_trees(ctx) == {second: path}
+
+
+def test_groups_by_size_then_hash(server, tmp_path, capsys):
+    ctx = server(3)
+    first, second, third = fixtures.mod_ids(3)
+    release(ctx, tmp_path, first, {'addons/x.pbo': b'a' * BLOCK, 'addons/unique.pbo': b'u' * (BLOCK + 1),
+                                    'small.txt': b's'})
+    release(ctx, tmp_path, second, {'addons/y.pbo': b'a' * BLOCK, 'small.txt': b's'})
+    release(ctx, tmp_path, third, {'addons/z.pbo': b'b' * BLOCK})
+    trees = dedup_trees(ctx)
+
+    groups = find_duplicates(ctx, trees, 4096)
+    assert [sorted((entry[0], entry[1]) for entry in group) for group in groups] == \
+        [[(first, 'addons/x.pbo'), (second, 'addons/y.pbo')]]
+    # Only sizes shared by several files were hashed
+    hashed = set((steam_id, path) for steam_id, path in
+                 ctx.conn.execute('select steam_id, path from mod_files where sha1 is not null;'))
+    assert hashed == {(first, 'addons/x.pbo'), (second, 'addons/y.pbo'), (third, 'addons/z.pbo')}
+    assert 'Hashing 3 file(s)' in capsys.readouterr().out
+
+    # A rerun takes the stored hashes
+    assert len(find_duplicates(ctx, trees, 4096)) == 1
+    assert 'Hashing' not in capsys.readouterr().out
+
+
+def test_dedup_links_and_dry_run_leaves_the_tree_alone(server, tmp_path):
+    ctx = server(2)
+    first, second = fixtures.mod_ids(2)
+    one = release(ctx, tmp_path, first, {'addons/x.pbo': b'a' * BLOCK})
+    two = release(ctx, tmp_path, second, {'addons/y.pbo': b'a' * BLOCK})
+    before = (inodes(one), inodes(two))
+
+    assert dedup(ctx, dry_run=True) == BLOCK
+    assert (inodes(one), inodes(two)) == before
+
+    assert dedup(ctx) == BLOCK
+    assert inodes(one)['addons/x.pbo'] == inodes(two)['addons/y.pbo']
+    with open(os.path.join(two, 'addons', 'y.pbo'), 'rb') as f:
+        assert f.read() == b'a' * BLOCK
+    # Nothing left to free
+    assert dedup(ctx) == 0
+
+
+def test_freed_space_needs_every_link_of_an_inode(tmp_path):
+    for name in ('keeper', 'copy', 'shared'):
+        (tmp_path / name).write_bytes(b'a' * BLOCK)
+    # Linked from outside the group, replacing the copy in the group frees nothing
+    os.link(str(tmp_path / 'shared'), str(tmp_path / 'outside'))
+    os.link(str(tmp_path / 'keeper'), str(tmp_path / 'keeper2'))
+    entries = [(1, name, str(tmp_path / name), BLOCK) for name in ('keeper', 'copy', 'shared')]
+    linked, freed = link_group(entries, dry_run=False)
+    assert freed == BLOCK
+    assert sorted(entry[1] for entry, stat in linked) == ['copy', 'shared']
+    keeper = os.stat(str(tmp_path / 'keeper')).st_ino
+    assert os.stat(str(tmp_path / 'copy')).st_ino == keeper
+    assert os.stat(str(tmp_path / 'shared')).st_ino == keeper
+    assert os.stat(str(tmp_path / 'outside')).st_ino != keeper
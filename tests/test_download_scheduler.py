@@ -0,0 +1,103 @@
+import time
+from datetime import datetime
+
+import fixtures
+from classes.download_scheduler import download_scheduler, parse_deadline
+
+MB = 1024 * 1024
+
+
+def test_parse_deadline():
+    now = datetime(2024, 1, 1, 4, 0)
+    assert parse_deadline('05:30', now) == time.mktime(datetime(2024, 1, 1, 5, 30).timetuple())
+    # Already passed today, so it's tomorrow's
+    assert parse_deadline('03:00', now) == time.mktime(datetime(2024, 1, 2, 3, 0).timetuple())
+
+
+def test_order_by_size_unknown_sizes_last(server):
+    ctx = server(1)
+    scheduler = download_scheduler(ctx)
+    sizes = {1: 3 * MB, 2: None, 3: MB, 4: 2 * MB}
+    assert scheduler.ordered(sizes) == [3, 4, 1, 2]
+    scheduler.order = 'largest'
+    assert scheduler.ordered(sizes) == [1, 4, 3, 2]
+
+
+def test_batches_split_the_queue_over_the_workers(server):
+    ctx = server(1)
+    ctx.config['downloads'] = {'workers': 2, 'parallel_logins': True}
+    scheduler = download_scheduler(ctx)
+    queue = [(mod_id, 0, 0) for mod_id in range(5)]
+    sizes = dict((mod_id, MB) for mod_id in range(5))
+    assert [entry[0] for entry in scheduler.next_batch(queue, sizes, None, set())] == [0, 1, 2]
+    # Retries wait for their turn
+    queue.insert(0, (9, 1, time.time() + 60))
+    assert [entry[0] for entry in scheduler.next_batch(queue, sizes, None, set())] == [3, 4]
+    assert [entry[0] for entry in queue] == [9]
+
+
+def test_parallel_sessions_need_parallel_logins(server, capsys):
+    ctx = server(1)
+    ctx.config['downloads'] = {'workers': 3}
+    assert download_scheduler(ctx).workers == 1
+    assert 'parallel_logins' in capsys.readouterr().out
+    ctx.config['downloads'] = {'workers': 3, 'parallel_logins': True}
+    assert download_scheduler(ctx).workers == 3
+
+
+def test_throttle_is_shared_but_never_dropped(server):
+    ctx = server(1)
+    ctx.config['downloads'] = {'workers': 4, 'parallel_logins': True, 'max_kbps': 3}
+    assert download_scheduler(ctx).throttle == 1
+    ctx.config['downloads'] = {'workers': 4, 'parallel_logins': True, 'max_kbps': 8000}
+    assert download_scheduler(ctx).throttle == 2000
+    ctx.config['downloads'] = {'workers': 4, 'parallel_logins': True}
+    assert download_scheduler(ctx).throttle is None
+
+
+def test_items_that_cant_make_the_deadline_are_postponed(server):
+    ctx = server(1)
+    scheduler = download_scheduler(ctx, deadline=time.time() + 10)
+    queue = [(1, 0, 0), (2, 0, 0), (3, 0, 0)]
+    sizes = {1: 5 * MB, 2: 50 * MB, 3: None}
+    postponed = set()
+    # 1 MB/s: 5 seconds fit, 50 don't, without a size there's nothing to go by
+    batch = scheduler.next_batch(queue, sizes, MB, postponed)
+    assert [entry[0] for entry in batch] == [1, 3]
+    assert postponed == {2}
+    assert queue == []
+
+
+def test_run_retries_failures_and_reports_every_item(server, monkeypatch, capsys):
+    ctx = server(3)
+    first, second, third = fixtures.mod_ids(3)
+    monkeypatch.setenv('FAKE_STEAMCMD_FLAKY', str(second))
+    monkeypatch.setenv('FAKE_STEAMCMD_FAIL', str(third))
+    downloaded, failed, postponed = download_scheduler(ctx).run([first, second, third])
+    assert sorted(downloaded) == [first, second]
+    assert failed == {third}
+    assert postponed == set()
+    out = capsys.readouterr().out
+    # steamcmd_retries is 2 in the fixture config, so third fails for good on its second try
+    assert 'Retrying {} in 0s...'.format(second) in out
+    assert 'Retrying {} in 0s...'.format(third) in out
+    progress = [line for line in out.splitlines() if 'mod(s) downloaded' in line]
+    assert progress[0].startswith('1/3 mod(s) downloaded')
+    assert progress[-1].startswith('2/3 mod(s) downloaded')
+
+
+def test_progress_is_printed_while_the_session_runs(server, monkeypatch):
+    ctx = server(3)
+    ids = fixtures.mod_ids(3)
+    scheduler = download_scheduler(ctx)
+    seen = []
+    print_progress = scheduler.print_progress
+
+    def record(done, count, done_bytes, total, started):
+        seen.append(done)
+        print_progress(done, count, done_bytes, total, started)
+    monkeypatch.setattr(scheduler, 'print_progress', record)
+    # The default config downloads the whole queue in one session
+    downloaded, failed, postponed = scheduler.run(ids)
+    assert sorted(downloaded) == ids
+    assert seen == [1, 2, 3]
@@ -0,0 +1,61 @@
+import os
+
+import fixtures
+from classes.mod_updates import copy_keys
+
+
+def link(target, path):
+    os.symlink(str(target), str(path))
+
+
+def test_copy_keys_only_removes_links_it_manages(server, tmp_path):
+    ctx = server(2)
+    first, second = fixtures.mod_ids(2)
+    keys = ctx.key_directory
+    mod = ctx.mod_path(first)
+
+    local = tmp_path / 'local_mod'
+    local.mkdir()
+    (local / 'local.bikey').write_text('local')
+    link(local / 'local.bikey', os.path.join(keys, 'local.bikey'))
+    link(tmp_path / 'gone.bikey', os.path.join(keys, 'broken.bikey'))
+    os.makedirs(os.path.join(mod, 'Extra'))
+    with open(os.path.join(mod, 'Extra', 'old.bikey'), 'w') as f:
+        f.write('old')
+    link(os.path.join(mod, 'Extra', 'old.bikey'), os.path.join(keys, 'old.bikey'))
+    # A key of the first mod that points into the second one
+    link(os.path.join(ctx.mod_path(second), 'Meta.cpp'), os.path.join(keys, 'Mod0.bikey'))
+    with open(os.path.join(keys, 'a3.bikey'), 'w') as f:
+        f.write('vanilla')
+
+    added, removed = copy_keys(ctx)
+
+    assert sorted(added) == ['Mod0.bikey', 'Mod1.bikey']
+    assert sorted(removed) == ['broken.bikey', 'old.bikey']
+    assert sorted(os.listdir(keys)) == ['Mod0.bikey', 'Mod1.bikey', 'a3.bikey', 'local.bikey']
+    assert os.readlink(os.path.join(keys, 'local.bikey')) == str(local / 'local.bikey')
+    assert os.readlink(os.path.join(keys, 'Mod0.bikey')) == os.path.join(mod, 'Keys', 'Server', 'Mod0.bikey')
+    assert not os.path.islink(os.path.join(keys, 'a3.bikey'))
+
+
+def test_copy_keys_unlinks_mods_that_left_the_config(server):
+    ctx = server(2)
+    first, second = fixtures.mod_ids(2)
+    copy_keys(ctx)
+    with open(ctx.config_path, 'w') as f:
+        f.write('mods="mods/@mod{}\\;"\n'.format(first))
+    added, removed = copy_keys(ctx)
+    assert (added, removed) == ([], ['Mod1.bikey'])
+    assert sorted(os.listdir(ctx.key_directory)) == ['Mod0.bikey']
+
+
+def test_keys_in_subfolders_are_linked_by_file_name(server):
+    ctx = server(1)
+    mod = ctx.mod_path(fixtures.mod_ids(1)[0])
+    os.makedirs(os.path.join(mod, 'Keys', 'Server', 'Old'))
+    with open(os.path.join(mod, 'Keys', 'Server', 'Old', 'Mod0_old.bikey'), 'w') as f:
+        f.write('old')
+    added, removed = copy_keys(ctx)
+    # The folders themselves are never linked, Arma wouldn't look inside
+    assert sorted(added) == ['Mod0.bikey', 'Mod0_old.bikey']
+    assert sorted(os.listdir(ctx.key_directory)) == ['Mod0.bikey', 'Mod0_old.bikey']
@@ -0,0 +1,36 @@
+import gzip
+import os
+from types import SimpleNamespace
+
+from classes.log_analyzer import find_events, log_files
+from classes.server import LOGIN_PATTERN, LOGOUT_PATTERN
+
+PATTERNS = (LOGIN_PATTERN.pattern, LOGOUT_PATTERN.pattern)
+
+
+def test_find_events():
+    buffer = b' 12:00:00 Player Bob connecting.\n\n 12:30:00 Player Bob disconnected.\n'
+    assert find_events(buffer, PATTERNS) == [(0, 43200, 1, 'Bob'), (34, 45000, -1, 'Bob')]
+
+
+def test_find_events_with_crlf():
+    buffer = b' 12:00:00 Player Bob connecting.\r\n 12:30:00 Player Bob disconnected.\r\n'
+    assert find_events(buffer, PATTERNS) == [(0, 43200, 1, 'Bob'), (34, 45000, -1, 'Bob')]
+
+
+def test_log_files_include_rotated_and_archived_logs(tmp_path):
+    console = tmp_path / 'console'
+    console.mkdir()
+    log_path = str(console / 'arma3server-console.log')
+    names = ['arma3server-console-2024-01-01-12:00:00.log', 'arma3server-console-2024-01-02-12:00:00.log.gz',
+             'arma3server-console.log.1.gz', 'arma3server-console.log']
+    for mtime, name in enumerate(names):
+        path = str(console / name)
+        with (gzip.open if name.endswith('.gz') else open)(path, 'wb') as f:
+            f.write(b' 12:00:00 Player Bob connecting.\n')
+        os.utime(path, (1000000000 + mtime, 1000000000 + mtime))
+    # Another instance's log in the same folder is not ours
+    (console / 'arma3server-2-console.log').write_bytes(b'')
+    (console / 'arma3server-console-notes.txt').write_bytes(b'')
+    instance = SimpleNamespace(log_path=log_path)
+    assert [os.path.basename(path) for path in log_files(instance)] == names
@@ -0,0 +1,85 @@
+import os
+
+import fixtures
+from classes.lowercase import lowercase_tree, tree_fingerprint
+
+
+def make(root, files):
+    for path, content in files.items():
+        path = os.path.join(str(root), path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+def tree(root):
+    found = {}
+    for folder, dirs, files in os.walk(str(root)):
+        for name in files:
+            path = os.path.join(folder, name)
+            with open(path) as f:
+                found[os.path.relpath(path, str(root))] = f.read()
+    return found
+
+
+def test_renames_deepest_entries_first(tmp_path):
+    make(tmp_path, {'Addons/Sub/Mod.PBO': 'a', 'Keys/Mod.bikey': 'k', 'meta.cpp': 'm'})
+    renamed, collisions = lowercase_tree(str(tmp_path))
+    assert collisions == []
+    assert renamed == 5
+    assert tree(tmp_path) == {'addons/sub/mod.pbo': 'a', 'keys/mod.bikey': 'k', 'meta.cpp': 'm'}
+
+
+def test_existing_lowercase_names_win_without_replace(tmp_path):
+    make(tmp_path, {'addons/mod.pbo': 'old', 'addons/Mod.pbo': 'new'})
+    renamed, collisions = lowercase_tree(str(tmp_path))
+    assert renamed == 0
+    assert collisions == [str(tmp_path / 'addons' / 'Mod.pbo')]
+    assert tree(tmp_path) == {'addons/mod.pbo': 'old', 'addons/Mod.pbo': 'new'}
+
+
+def test_replace_merges_fresh_download_into_old_tree(tmp_path):
+    # The last version was lowercased, steamcmd wrote the new one in mixed case next to it
+    make(tmp_path, {'addons/mod.pbo': 'old', 'addons/gone.pbo': 'old',
+                    'Addons/Mod.pbo': 'new', 'Addons/New.pbo': 'new'})
+    renamed, collisions = lowercase_tree(str(tmp_path), replace=True)
+    assert collisions == []
+    assert tree(tmp_path) == {'addons/mod.pbo': 'new', 'addons/new.pbo': 'new', 'addons/gone.pbo': 'old'}
+    assert not os.path.exists(str(tmp_path / 'Addons'))
+
+
+def test_replace_never_puts_a_file_over_a_folder(tmp_path):
+    make(tmp_path, {'keys/a.bikey': 'k', 'Keys': 'file'})
+    renamed, collisions = lowercase_tree(str(tmp_path), replace=True)
+    assert collisions == [str(tmp_path / 'Keys')]
+    assert tree(tmp_path) == {'keys/a.bikey': 'k', 'Keys': 'file'}
+
+
+def test_fingerprint_follows_top_two_levels(tmp_path):
+    addons = str(tmp_path / 'addons')
+    make(tmp_path, {'addons/mod.pbo': 'a'})
+    # Timestamps can be coarser than the test, start from a time long gone
+    os.utime(addons, ns=(10 ** 9, 10 ** 9))
+    before = tree_fingerprint(str(tmp_path))
+    assert tree_fingerprint(str(tmp_path)) == before
+    make(tmp_path, {'addons/Extra.pbo': 'b'})
+    changed = tree_fingerprint(str(tmp_path))
+    assert changed != before
+    os.utime(addons, ns=(10 ** 9, 10 ** 9))
+    lowercase_tree(str(tmp_path))
+    assert tree_fingerprint(str(tmp_path)) != before
+
+
+def test_steamcmd_folders_are_lowercased_as_a_release_copy(server):
+    from classes.mod_updates import lowercase_workshop_dir
+    ctx = server(2)
+    first, second = fixtures.mod_ids(2)
+    workshop = ctx.mod_path(first)
+    before = tree(workshop)
+    lowercase_workshop_dir(ctx, ())
+    # validate would fetch every renamed entry again, steamcmd's folder stays as it was
+    assert tree(workshop) == before
+    release = ctx.pending_releases[first]
+    assert release.startswith(ctx.staging_directory)
+    assert tree(release) == dict((path.lower(), content) for path, content in before.items())
+    assert ctx.mod_path(first, staged=True) == release
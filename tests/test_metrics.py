@@ -0,0 +1,20 @@
+from classes.metrics import metrics
+
+
+def test_textfile_sums_repeated_phases(tmp_path):
+    run = metrics(textfile_dir=str(tmp_path))
+    for seconds in (1.0, 0.5):
+        with run.phase('copy_keys'):
+            run.count('links_created', 2)
+        run.phases[-1]['seconds'] = seconds
+    with run.phase('generate_preset'):
+        pass
+    run.write('update_mods')
+    lines = (tmp_path / 'arma3_utils_update_mods.prom').read_text().splitlines()
+    phases = [line for line in lines if line.startswith('arma3_utils_phase_duration_seconds')]
+    assert phases == ['arma3_utils_phase_duration_seconds{command="update_mods",phase="copy_keys"} 1.500',
+                      'arma3_utils_phase_duration_seconds{command="update_mods",phase="generate_preset"} 0.000']
+    assert 'arma3_utils_last_run_links_created{command="update_mods"} 4' in lines
+    # Every series is unique, node_exporter refuses the whole file otherwise
+    series = [line.rsplit(' ', 1)[0] for line in lines if not line.startswith('#')]
+    assert len(series) == len(set(series))
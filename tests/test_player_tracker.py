@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from classes.arma3_db import arma3_db
+from classes.player_tracker import player_tracker
+from classes.server import LOGIN_PATTERN, LOGOUT_PATTERN
+
+
+@pytest.fixture
+def tracker(tmp_path):
+    conn = arma3_db(str(tmp_path / 'arma3_utils.db')).connect()
+    log_path = str(tmp_path / 'console.log')
+    yield player_tracker(conn, log_path, LOGIN_PATTERN, LOGOUT_PATTERN)
+    conn.close()
+
+
+def append(path, text, mode='ab'):
+    with open(path, mode) as f:
+        f.write(text.encode('utf-8'))
+
+
+def test_logins_and_logouts(tracker):
+    append(tracker.log_path, ' 12:00:00 Player Ann connecting.\n'
+                             ' 12:00:01 Player Bob connecting.\n'
+                             ' 12:05:00 Player Ann disconnected.\n')
+    assert tracker.update() == {'Bob'}
+
+
+def test_crlf_lines(tracker):
+    append(tracker.log_path, ' 12:00:00 Player Win connecting.\r\n'
+                             ' 12:00:01 Player Lin connecting.\r\n'
+                             ' 12:05:00 Player Lin disconnected.\r\n')
+    assert tracker.update() == {'Win'}
+
+
+def test_only_new_lines_are_read(tracker):
+    append(tracker.log_path, ' 12:00:00 Player Ann connecting.\n')
+    assert tracker.update() == {'Ann'}
+    size = os.path.getsize(tracker.log_path)
+    append(tracker.log_path, ' 12:05:00 Player Ann disconnected.\n')
+    assert tracker.update() == set()
+    assert tracker.load_state()[1] == os.path.getsize(tracker.log_path) > size
+
+
+def test_partial_last_line_waits_for_its_end(tracker):
+    append(tracker.log_path, ' 12:00:00 Player Ann connecting.\n 12:00:01 Player Bob conn')
+    assert tracker.update() == {'Ann'}
+    append(tracker.log_path, 'ecting.\n')
+    assert tracker.update() == {'Ann', 'Bob'}
+
+
+def test_truncated_log_starts_over(tracker):
+    append(tracker.log_path, ' 12:00:00 Player Ann connecting.\n' * 3)
+    assert tracker.update() == {'Ann'}
+    # Same inode, lgsm truncated it and a new server session started
+    append(tracker.log_path, ' 13:00:00 Player Bob connecting.\n', mode='wb')
+    assert tracker.update() == {'Bob'}
+
+
+def test_rotated_log_starts_over(tracker):
+    append(tracker.log_path, ' 12:00:00 Player Ann connecting.\n')
+    assert tracker.update() == {'Ann'}
+    os.rename(tracker.log_path, tracker.log_path + '.1')
+    append(tracker.log_path, ' 13:00:00 Player Bob connecting.\n')
+    assert tracker.update() == {'Bob'}
@@ -0,0 +1,33 @@
+import os
+
+import fixtures
+from classes.presets import generate_all_presets
+
+
+def write_config(ctx, name, title, mod_ids):
+    with open(ctx.mod_config_folder + name, 'w') as f:
+        if title:
+            f.write('# {}\n'.format(title))
+        f.write('mods="{}"\n'.format(''.join('mods/@mod{}\\;'.format(x) for x in mod_ids)))
+
+
+def test_conf_files_count_as_configs(server):
+    ctx = server(2)
+    first, second = fixtures.mod_ids(2)
+    write_config(ctx, 'converted.conf', None, [second])
+    assert generate_all_presets(ctx) == 2
+    assert sorted(os.listdir(ctx.modlist_dir)) == ['converted.html', 'synthetic_pack.html']
+    with open(ctx.modlist_dir + 'converted.html') as f:
+        assert 'Synthetic Mod {}'.format(second) in f.read()
+
+
+def test_duplicate_titles_fall_back_to_the_file_name(server, capsys):
+    ctx = server(2)
+    first, second = fixtures.mod_ids(2)
+    write_config(ctx, 'zz_copy.cfg', 'Synthetic Pack', [first])
+    assert generate_all_presets(ctx) == 2
+    assert sorted(os.listdir(ctx.modlist_dir)) == ['synthetic_pack.html', 'zz_copy.html']
+    with open(ctx.modlist_dir + 'synthetic_pack.html') as f:
+        # The first config keeps its preset
+        assert 'Synthetic Mod {}'.format(second) in f.read()
+    assert 'zz_copy.cfg has the same title' in capsys.readouterr().out
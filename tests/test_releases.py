@@ -0,0 +1,194 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import fixtures
+from classes import server as server_module
+from classes.process_locator import process_locator
+from classes.mod_updates import copy_keys, create_mod_symlinks
+from classes.releases import activate_if_stopped, activate_staged, stage_releases, steamcmd_directory
+
+
+@pytest.fixture
+def two_instances(server):
+    """ two instances sharing the synthetic workshop, with their mods and keys linked """
+    ctx = server(2)
+    ctx.config['keep_releases'] = 1
+    ctx.config['instances'] = [{'name': 'main'},
+                               {'name': 'training', 'lgsm_binary': 'arma3server-2',
+                                'paths': {'mod_directory': 'serverfiles-2/mods/',
+                                          'key_directory': 'serverfiles-2/keys/'}}]
+    for instance in ctx.instances:
+        os.makedirs(instance.mod_directory, exist_ok=True)
+        os.makedirs(instance.key_directory, exist_ok=True)
+        create_mod_symlinks(instance)
+        copy_keys(instance)
+    return ctx
+
+
+def stage(ctx, mod_id, key):
+    """ stage a download of mod_id whose only key is called key, returns the release folder """
+    content = ctx.steamcmd.content_path(steamcmd_directory(ctx), mod_id)
+    # Like a new version that replaced the key of the cached one
+    shutil.rmtree(content, ignore_errors=True)
+    os.makedirs(os.path.join(content, 'keys'))
+    with open(os.path.join(content, 'keys', key), 'w') as f:
+        f.write(key)
+    stage_releases(ctx, {mod_id: steamcmd_directory(ctx)})
+    return ctx.pending_releases[mod_id]
+
+
+def mod_link(instance, mod_id):
+    return os.readlink('{}@mod{}'.format(instance.mod_directory, mod_id))
+
+
+def key_links(instance):
+    return dict((key, os.readlink(os.path.join(instance.key_directory, key)))
+                for key in os.listdir(instance.key_directory))
+
+
+def test_restart_switches_only_the_restarted_instance(two_instances):
+    ctx = two_instances
+    main, training = ctx.instances
+    mod_id = fixtures.mod_ids(2)[1]
+    old = ctx.mod_path(mod_id)
+    release = stage(ctx, mod_id, 'new.bikey')
+
+    assert activate_staged(ctx, instances=[main]) == {mod_id}
+    assert mod_link(main, mod_id) == release
+    assert key_links(main)['new.bikey'] == os.path.join(release, 'keys', 'new.bikey')
+    assert 'Mod1.bikey' not in key_links(main)
+    # The running instance keeps its mod and keys
+    assert mod_link(training, mod_id) == old
+    assert key_links(training)['Mod1.bikey'] == os.path.join(old, 'Keys', 'Mod1.bikey')
+    assert 'new.bikey' not in key_links(training)
+    assert ctx.pending_releases == {mod_id: release}
+    assert main.mod_path(mod_id) == release and training.mod_path(mod_id) == old
+
+    assert activate_staged(ctx, instances=[training]) == {mod_id}
+    assert mod_link(training, mod_id) == release
+    assert 'new.bikey' in key_links(training)
+    assert ctx.pending_releases == {}
+    assert ctx.mod_path(mod_id) == release
+    assert ctx.conn.execute('select count(*) from release_instances;').fetchone()[0] == 0
+
+
+def test_releases_are_kept_until_every_instance_switched(two_instances):
+    ctx = two_instances
+    main, training = ctx.instances
+    mod_id = fixtures.mod_ids(2)[1]
+    first = stage(ctx, mod_id, 'first.bikey')
+    activate_staged(ctx)
+    second = stage(ctx, mod_id, 'second.bikey')
+    activate_staged(ctx, instances=[main])
+
+    # main runs second, so the third release can't replace it in the database or on disk
+    third = stage(ctx, mod_id, 'third.bikey')
+    assert os.path.isdir(second)
+    assert ctx.pending_releases == {mod_id: third}
+    assert main.mod_path(mod_id) == second
+
+    activate_staged(ctx, instances=[training])
+    assert mod_link(training, mod_id) == third
+    assert os.path.isdir(first) and os.path.isdir(second)
+    assert ctx.mod_path(mod_id) == first
+
+    activate_staged(ctx, instances=[main])
+    assert ctx.mod_path(mod_id) == third
+    # The superseded release and the one beyond keep_releases are gone once nobody runs them
+    assert not os.path.exists(second)
+    assert not os.path.exists(first)
+    assert ctx.pending_releases == {}
+
+
+def test_activate_if_stopped_leaves_running_instances_alone(two_instances, monkeypatch):
+    ctx = two_instances
+    main, training = ctx.instances
+    mod_id = fixtures.mod_ids(2)[1]
+    old = ctx.mod_path(mod_id)
+    release = stage(ctx, mod_id, 'new.bikey')
+    monkeypatch.setattr(server_module, 'check_running', lambda instance: instance.name == 'main')
+
+    assert activate_if_stopped(ctx) == {'main': set(), 'training': {mod_id}}
+    assert mod_link(main, mod_id) == old
+    assert mod_link(training, mod_id) == release
+    # Already switched, nothing to do the second time
+    assert activate_if_stopped(ctx) == {'main': set(), 'training': set()}
+
+
+def test_plan_activates_per_instance(two_instances, monkeypatch):
+    from classes.planner import apply_plan, make_plan
+    ctx = two_instances
+    main, training = ctx.instances
+    mod_id = fixtures.mod_ids(2)[1]
+    old = ctx.mod_path(mod_id)
+    release = stage(ctx, mod_id, 'new.bikey')
+    monkeypatch.setattr(server_module, 'check_running', lambda instance: instance.name == 'main')
+    ctx.metadata.offline = True
+
+    plan = make_plan(ctx)
+    entries = dict((entry['name'], entry) for entry in plan['instances'])
+    assert plan['activate'] == [mod_id]
+    assert entries['main']['activate'] == []
+    assert entries['training']['activate'] == [mod_id]
+    # The synthetic workshop also needs lowercasing, only look at the keys of the staged mod
+    changes = dict((name, sorted((action, key) for action, key, target in entries[name]['key_links']
+                                 if key in ('Mod1.bikey', 'new.bikey'))) for name in entries)
+    assert changes == {'main': [], 'training': [('create', 'new.bikey'), ('remove', 'Mod1.bikey')]}
+
+    apply_plan(ctx, plan)
+    assert mod_link(main, mod_id) == old
+    assert mod_link(training, mod_id) == release
+    assert 'new.bikey' in key_links(training) and 'new.bikey' not in key_links(main)
+
+
+def start_game(tmp_path, server_config):
+    """ a process that looks like lgsm's arma3server_x64 started with -config=server_config """
+    binary = str(tmp_path / 'serverfiles' / 'arma3server_x64')
+    return subprocess.Popen([binary, '-c', 'import time; time.sleep(60)', '-port=2302',
+                             '-config={}'.format(tmp_path / 'serverfiles' / 'cfg' / server_config)],
+                            executable=sys.executable)
+
+
+def test_process_locator_tells_instances_apart():
+    cmdline = ['./arma3server_x64', '-port=2402', '-config=/srv/serverfiles/cfg/arma3server-2.server.cfg']
+    assert process_locator('arma3server', None, 'arma3server-2.server.cfg').matches('arma3server_x64', cmdline)
+    assert not process_locator('arma3server', None, 'arma3server.server.cfg').matches('arma3server_x64', cmdline)
+    # Without -config= there's no telling, it counts as running for everyone
+    assert process_locator('arma3server', None, 'arma3server.server.cfg').matches('arma3server_x64',
+                                                                                 cmdline[:2])
+    assert not process_locator('arma3server', None, 'arma3server.server.cfg').matches('bash', ['bash'])
+
+
+def test_running_second_instance_keeps_its_links(two_instances, tmp_path):
+    ctx = two_instances
+    main, training = ctx.instances
+    mod_id = fixtures.mod_ids(2)[1]
+    old = ctx.mod_path(mod_id)
+    release = stage(ctx, mod_id, 'new.bikey')
+    process = start_game(tmp_path, 'arma3server-2.server.cfg')
+    try:
+        assert not server_module.check_running(main)
+        assert server_module.check_running(training)
+        assert activate_if_stopped(ctx) == {'main': {mod_id}, 'training': set()}
+    finally:
+        process.kill()
+        process.wait()
+    assert mod_link(main, mod_id) == release
+    assert mod_link(training, mod_id) == old
+    assert 'new.bikey' not in key_links(training)
+
+
+def test_staging_keeps_the_download_as_a_cache(two_instances):
+    ctx = two_instances
+    mod_id = fixtures.mod_ids(2)[1]
+    release = stage(ctx, mod_id, 'Mixed.bikey')
+    content = ctx.steamcmd.content_path(steamcmd_directory(ctx), mod_id)
+    # steamcmd finds its download untouched, validate patches it next time
+    assert os.listdir(os.path.join(content, 'keys')) == ['Mixed.bikey']
+    assert os.listdir(os.path.join(release, 'keys')) == ['Mixed.bikey']
+    assert os.stat(os.path.join(content, 'keys', 'Mixed.bikey')).st_ino != \
+        os.stat(os.path.join(release, 'keys', 'Mixed.bikey')).st_ino
@@ -0,0 +1,116 @@
+import shutil
+import socket
+from types import SimpleNamespace
+from urllib import error, parse
+
+import pytest
+
+import fixtures
+from classes import mod_updates, steam_api as steam_api_module
+from classes.mod_updates import check_for_updates
+from classes.steam_api import fetch_url, steam_api
+
+API_PATH = '/ISteamRemoteStorage/GetPublishedFileDetails/v1/'
+FORM = parse.urlencode({'itemcount': 1, 'publishedfileids[0]': 1}).encode('utf-8')
+
+
+def api_url(server):
+    return 'http://127.0.0.1:{}{}'.format(server.server_port, API_PATH)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    # Only the backoff of fetch_url, the fake Steam keeps its own delay
+    monkeypatch.setattr(steam_api_module, 'time', SimpleNamespace(sleep=delays.append))
+    return delays
+
+
+@pytest.mark.parametrize('status', [500, 502, 503, 429])
+def test_retries_server_errors_and_throttling(steam, sleeps, status):
+    server = steam(failures=[status, status])
+    body = fetch_url(api_url(server), FORM, timeout=5, retries=3, backoff=1)
+    assert 'publishedfiledetails' in body
+    assert sleeps == [1, 2]
+    assert len(server.RequestHandlerClass.requests) == 3
+
+
+@pytest.mark.parametrize('status', [400, 403, 404])
+def test_client_errors_are_not_retried(steam, sleeps, status):
+    server = steam(failures=[status])
+    with pytest.raises(error.HTTPError) as raised:
+        fetch_url(api_url(server), FORM, timeout=5, retries=3, backoff=1)
+    assert raised.value.code == status
+    assert sleeps == []
+    assert len(server.RequestHandlerClass.requests) == 1
+
+
+def test_gives_up_after_the_last_retry(steam, sleeps):
+    server = steam(failures=[503] * 4)
+    with pytest.raises(error.HTTPError) as raised:
+        fetch_url(api_url(server), FORM, timeout=5, retries=2, backoff=0.5)
+    assert raised.value.code == 503
+    assert sleeps == [0.5, 1.0]
+    assert len(server.RequestHandlerClass.requests) == 3
+
+
+def test_timeouts_are_retried_then_raised(steam, sleeps):
+    server = steam(delay=1)
+    with pytest.raises((socket.timeout, error.URLError)):
+        fetch_url(api_url(server), FORM, timeout=0.2, retries=1, backoff=0)
+    assert sleeps == [0]
+    assert len(server.RequestHandlerClass.requests) == 2
+
+
+def test_connection_errors_are_retried(sleeps):
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    with pytest.raises(error.URLError):
+        fetch_url('http://127.0.0.1:{}/'.format(port), FORM, timeout=1, retries=2, backoff=0)
+    assert len(sleeps) == 2
+
+
+def test_get_details_batches_and_parses_items(steam):
+    server = steam()
+    api = steam_api(api_url(server), workers=2)
+    api.batch_size = 2
+    details = api.get_details([3, 1, 2, 2])
+    assert sorted(details) == [1, 2, 3]
+    assert details[2]['title'] == 'Synthetic Mod 2'
+    assert details[2]['file_size'] == 2 * 1024 * 1024
+    assert len(server.RequestHandlerClass.requests) == 2
+
+
+def test_outdated_set(server):
+    updated = fixtures.FIRST_MOD_ID + 1
+    missing = fixtures.FIRST_MOD_ID + 3
+    ctx = server(4, outdated=[updated])
+    shutil.rmtree(ctx.mod_path(missing))
+    assert check_for_updates(ctx, ctx.mods) == {updated, missing}
+
+
+def test_outdated_set_from_installed_snapshot(server):
+    ctx = server(3)
+    # Mods outside installed count as missing, whatever is on disk
+    outdated = check_for_updates(ctx, ctx.mods, installed={fixtures.FIRST_MOD_ID})
+    assert outdated == {fixtures.FIRST_MOD_ID + 1, fixtures.FIRST_MOD_ID + 2}
+
+
+def test_outdated_set_offline_without_cache(server):
+    ctx = server(2)
+    ctx.metadata.offline = True
+    # Never looked up, so there is nothing to compare against
+    assert check_for_updates(ctx, ctx.mods) == set()
+
+
+def test_installed_snapshot_does_not_look_at_mod_folders(server, monkeypatch):
+    ctx = server(3, outdated=[fixtures.FIRST_MOD_ID])
+    ids = fixtures.mod_ids(3)
+    ctx.metadata.mark_installed(ids, installed_at=1500000000)
+    looked_at = []
+    monkeypatch.setattr(mod_updates.os.path, 'isdir', looked_at.append)
+    monkeypatch.setattr(mod_updates.os.path, 'getctime', looked_at.append)
+    assert check_for_updates(ctx, ctx.mods, installed=set(ids)) == {fixtures.FIRST_MOD_ID}
+    assert looked_at == []
@@ -0,0 +1,48 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+from classes import watcher as watcher_module
+from classes.watcher import watcher
+
+
+@pytest.fixture
+def watching(server, tmp_path):
+    ctx = server(1)
+    ctx.config['watch'] = {'status_file': str(tmp_path / 'status.json'), 'update_interval': 3600,
+                           'retry_interval': 60}
+    return watcher(ctx, restart_when_empty=True)
+
+
+def status(w):
+    with open(w.status_file) as f:
+        return json.load(f)
+
+
+def test_failed_update_is_recorded_and_retried_sooner(watching, monkeypatch):
+    def locked(ctx):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(watcher_module, 'run_update', locked)
+    watching.cycle()
+    assert status(watching)['last_error']['action'] == 'update'
+    assert 'database is locked' in status(watching)['last_error']['error']
+    assert time.time() + 50 < watching.next_update <= time.time() + 60
+
+    monkeypatch.setattr(watcher_module, 'run_update', lambda ctx: {1})
+    watching.next_update = 0
+    watching.cycle()
+    assert status(watching)['last_update']['downloaded'] == [1]
+    assert watching.next_update > time.time() + 3000
+
+
+def test_failed_restart_stays_pending(watching, monkeypatch):
+    def missing(instance):
+        raise FileNotFoundError('arma3server')
+    watching.next_update = time.time() + 3600
+    watching.pending_restarts = {watching.ctx.name}
+    monkeypatch.setattr(watcher_module, 'check_running', missing)
+    watching.cycle()
+    assert status(watching)['last_error']['action'] == 'restart'
+    assert status(watching)['pending_actions'] == ['restart {}'.format(watching.ctx.name)]
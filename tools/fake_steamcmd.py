@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+"""Stand-in for steamcmd so downloads can be exercised offline.
+
+Understands the commands arma3_utils sends, either chained on the command
+line (+login u p +workshop_download_item 107410 123 validate +quit) or
+through +runscript. Every downloaded item gets a small mixed-case mod tree
+with an addon and a key, and the same output lines steamcmd prints.
+
+Environment:
+    FAKE_STEAMCMD_ROOT   install root, default ~/.local/share/Steam
+    FAKE_STEAMCMD_FAIL   comma separated ids that always fail
+    FAKE_STEAMCMD_FLAKY  comma separated ids that fail on their first try
+    FAKE_STEAMCMD_SIZE   size of the generated pbo in bytes, default 1024
+"""
+import os
+import shlex
+import sys
+
+
+def parse_commands(argv):
+    commands = []
+    for arg in argv:
+        if arg.startswith('+'):
+            commands.append([arg[1:]])
+        elif commands:
+            commands[-1].append(arg)
+    expanded = []
+    for command in commands:
+        if command[0] == 'runscript':
+            with open(command[1]) as script:
+                for line in script:
+                    if line.strip() and not line.startswith('@'):
+                        expanded.append(shlex.split(line))
+        else:
+            expanded.append(command)
+    return expanded
+
+
+def env_ids(name):
+    return set(x for x in os.environ.get(name, '').split(',') if x)
+
+
+def download_item(root, app_id, mod_id):
+    path = os.path.join(root, 'steamapps', 'workshop', 'content', app_id, mod_id)
+    if mod_id in env_ids('FAKE_STEAMCMD_FAIL'):
+        print('ERROR! Download item {} failed (Failure).'.format(mod_id))
+        return
+    marker = os.path.join(root, '.fake_steamcmd_{}'.format(mod_id))
+    if mod_id in env_ids('FAKE_STEAMCMD_FLAKY') and not os.path.exists(marker):
+        # force_install_dir may point at a folder that doesn't exist yet
+        os.makedirs(root, exist_ok=True)
+        open(marker, 'w').close()
+        print('ERROR! Timeout downloading item {}'.format(mod_id))
+        return
+    size = int(os.environ.get('FAKE_STEAMCMD_SIZE', 1024))
+    os.makedirs(os.path.join(path, 'Addons'), exist_ok=True)
+    os.makedirs(os.path.join(path, 'Keys'), exist_ok=True)
+    with open(os.path.join(path, 'Addons', 'Mod_{}.pbo'.format(mod_id)), 'wb') as f:
+        f.write(mod_id.encode('utf-8') * (size // len(mod_id) + 1))
+    with open(os.path.join(path, 'Keys', 'Mod_{}.bikey'.format(mod_id)), 'w') as f:
+        f.write(mod_id)
+    with open(os.path.join(path, 'Meta.cpp'), 'w') as f:
+        f.write('publishedid = {};\n'.format(mod_id))
+    print('Success. Downloaded item {} to "{}" ({} bytes)'.format(mod_id, path, size))
+
+
+def main():
+    root = os.environ.get('FAKE_STEAMCMD_ROOT', os.path.expanduser('~/.local/share/Steam'))
+    for command in parse_commands(sys.argv[1:]):
+        name = command[0].lower()
+        if name == 'force_install_dir':
+            root = command[1]
+        elif name == 'login':
+            print("Logging in user '{}' to Steam Public...OK".format(command[1]))
+        elif name == 'workshop_download_item':
+            download_item(root, command[1], command[2])
+        elif name == 'quit':
+            break
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
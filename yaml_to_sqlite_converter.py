@@ -1,21 +1,22 @@
 #!/usr/bin/python3
-import sqlite3
 import yaml
+from sqlite3 import Error
+from classes.arma3_db import arma3_db
 
 with open('mods.yaml') as file:
-    #MODS = yaml.load(file, Loader=yaml.FullLoader)
-    MODS = yaml.load(file)
+    MODS = yaml.load(file, Loader=yaml.FullLoader)
 
-conn = sqlite3.connect('arma3_utils.db')
-c = conn.cursor()
+conn = arma3_db('arma3_utils.db').connect()
 
-for steam_id in MODS.values():
-    try:
-        print("Inserting {}".format(steam_id))
-        c.execute("INSERT INTO mods (steam_id) VALUES ({});".format(steam_id))
-        conn.commit()
-    except:
-        print('Cant insert {}. Skipping...'.format(steam_id))
+# One transaction for the whole file, either everything is imported or nothing
+try:
+    with conn:
+        print("Inserting {} mods".format(len(MODS)))
+        conn.executemany("INSERT OR IGNORE INTO mods (steam_id) VALUES (?);",
+                         [(steam_id,) for steam_id in MODS.values()])
+        conn.executemany("INSERT OR IGNORE INTO mod_folders (steam_id, folder_name) VALUES (?, ?);",
+                         [(steam_id, folder_name) for folder_name, steam_id in MODS.items()])
+except Error as e:
+    print('Cant insert mods: {}'.format(e))
 
-conn.commit()
-conn.close()
\ No newline at end of file
+conn.close()